@@ -1,4 +1,25 @@
-import orofacial.grabcut_app
-import orofacial.jaw_tracking_convert
-import orofacial.tongue_mask_processing
-import orofacial.tongue_tip_track_2D
\ No newline at end of file
+import importlib
+
+# Submodules are imported on first access (PEP 562) so that `import orofacial`
+# does not pay for OpenCV, h5py and numba kernels that are never used.
+__all__ = [
+    "grabcut_app",
+    "jaw_tracking_convert",
+    "lick_analysis",
+    "pipeline",
+    "qc_video",
+    "result_cache",
+    "scheduler",
+    "tongue_mask_processing",
+    "tongue_tip_track_2D",
+]
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module(f"{__name__}.{name}")
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
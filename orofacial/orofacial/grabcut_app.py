@@ -34,6 +34,264 @@ import cv2 as cv
 import argparse 
 
 import sys, os
+import threading
+import concurrent.futures
+import time
+
+def	grabcut_multires(img, mask, rect, bgdmodel, fgdmodel, mode, scale=0.5, band=4, tile=64, min_size=480, min_keep=0.1):
+	"""
+	One GrabCut iteration run coarse-to-fine: the graph cut runs on a downscaled copy of the image,
+	and only a narrow band around the upsampled boundary is re-segmented at full resolution, in tiles,
+	with the colour models of the coarse pass frozen and everything outside the band fixed.
+
+	Parameters:
+	img (numpy.ndarray): The 8-bit 3-channel image.
+	mask (numpy.ndarray): The GrabCut mask, updated in place.
+	rect (tuple): The (x, y, w, h) rectangle, used with cv.GC_INIT_WITH_RECT.
+	bgdmodel (numpy.ndarray): The background model, updated in place.
+	fgdmodel (numpy.ndarray): The foreground model, updated in place.
+	mode (int): cv.GC_INIT_WITH_RECT, cv.GC_INIT_WITH_MASK or cv.GC_EVAL.
+	scale (float): The downscaling factor of the coarse pass.
+	band (int): The half width in pixels of the band refined at full resolution.
+	tile (int): The size of the tiles the band is refined in.
+	min_size (int): The minimum length of the short side of the coarse image.
+	min_keep (float): The fraction of the prior foreground (the rect, or the foreground of mask) that must
+	survive the coarse and the refined pass, otherwise the iteration is run again at full resolution.
+
+	The smoothness term of GrabCut is per edge, so the coarse pass shrinks thin parts of the subject and
+	can lose small subjects, in which case the iteration falls back to full resolution. The result is not
+	equivalent to a full resolution iteration, see README.md for the agreement on the example image.
+	"""
+	h, w = mask.shape
+	scale = max(scale, min_size / min(h, w))
+	if scale >= 1:
+		cv.grabCut(img, mask, rect, bgdmodel, fgdmodel, 1, mode)
+		return
+	if mode == cv.GC_INIT_WITH_RECT:
+		prior = rect[2] * rect[3]
+	else:
+		prior = np.count_nonzero(mask & 1)
+	models = (bgdmodel.copy(), fgdmodel.copy())
+
+	def	full_resolution():
+		bgdmodel[:], fgdmodel[:] = models
+		cv.grabCut(img, mask, rect, bgdmodel, fgdmodel, 1, mode)
+
+	size = (max(1, round(w * scale)), max(1, round(h * scale)))
+	small_img = cv.resize(img, size, interpolation=cv.INTER_AREA)
+	if mode == cv.GC_INIT_WITH_RECT:
+		small_mask = np.zeros(size[::-1], np.uint8)
+		small_rect = tuple(int(round(v * scale)) for v in rect)
+		x, y, rw, rh = rect
+		mask[:] = cv.GC_BGD
+		mask[y:y+rh, x:x+rw] = cv.GC_PR_BGD
+	else:
+		# majority vote of the foreground bit, then the sure labels that cover most of a coarse pixel
+		small_mask = (cv.resize((mask & 1) * 255, size, interpolation=cv.INTER_AREA) > 127).astype(np.uint8) | cv.GC_PR_BGD
+		for label in (cv.GC_BGD, cv.GC_FGD):
+			small_mask[cv.resize((mask == label).astype(np.uint8) * 255, size, interpolation=cv.INTER_AREA) > 127] = label
+		small_rect = rect
+	cv.grabCut(small_img, small_mask, small_rect, bgdmodel, fgdmodel, 1, mode)
+	if np.count_nonzero(small_mask & 1) < min_keep * prior * scale * scale:
+		full_resolution()
+		return
+
+	# upsample, keeping the sure labels of the full resolution mask
+	sure = (mask == cv.GC_BGD) | (mask == cv.GC_FGD)
+	up = cv.resize(small_mask, (w, h), interpolation=cv.INTER_NEAREST)
+	labels = np.where(sure, mask, (up & 1) | cv.GC_PR_BGD).astype(np.uint8)
+
+	fg = labels & 1
+	kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (2*band+1, 2*band+1))
+	ring = (cv.dilate(fg, kernel) != cv.erode(fg, kernel)) & ~sure
+	fixed = np.where(fg, cv.GC_FGD, cv.GC_BGD).astype(np.uint8)
+	fixed[ring] = labels[ring]
+	for y0 in range(0, h, tile):
+		for x0 in range(0, w, tile):
+			core = ring[y0:y0+tile, x0:x0+tile]
+			if not core.any():
+				continue
+			# a margin of the band width keeps the pairwise terms across tile borders
+			ty0, tx0 = max(y0 - band, 0), max(x0 - band, 0)
+			ty1, tx1 = min(y0 + tile + band, h), min(x0 + tile + band, w)
+			t = fixed[ty0:ty1, tx0:tx1].copy()
+			cv.grabCut(np.ascontiguousarray(img[ty0:ty1, tx0:tx1]), t, rect, bgdmodel, fgdmodel, 1, cv.GC_EVAL_FREEZE_MODEL)
+			t = t[y0-ty0:y0-ty0+core.shape[0], x0-tx0:x0-tx0+core.shape[1]]
+			labels[y0:y0+tile, x0:x0+tile][core] = t[core]
+	if np.count_nonzero(labels & 1) < min_keep * prior:
+		full_resolution()
+		return
+	mask[:] = labels
+
+def	seed_mask(seed, seed_format='binary'):
+	"""
+	Convert a single-channel seed image to a GrabCut mask for cv.GC_INIT_WITH_MASK.
+	Raises ValueError if the seed has no foreground, or labels outside 0 to 3.
+
+	Parameters:
+	seed (numpy.ndarray): The seed image.
+	seed_format (str): 'binary' for a mask in the format saved by the 's' key, where pixels above 127 become
+	probable foreground and the rest sure background, as in main.ipynb. 'labels' for GrabCut labels (0 to 3).
+
+	Returns:
+	numpy.ndarray: The GrabCut mask.
+	"""
+	if seed_format == 'binary':
+		mask = np.where(seed > 127, cv.GC_PR_FGD, cv.GC_BGD).astype(np.uint8)
+	elif seed_format == 'labels':
+		if seed.max() > cv.GC_PR_FGD:
+			raise ValueError("seed mask has values above %d, not GrabCut labels" % cv.GC_PR_FGD)
+		mask = seed.astype(np.uint8)
+	else:
+		raise ValueError("unknown seed format " + seed_format)
+	if not (mask & 1).any():
+		raise ValueError("empty seed mask, no foreground pixels")
+	return mask
+
+def	segment_file(in_path, out_path, seed_path=None, rect=None, iters=5, scale=1.0, seed_format='binary'):
+	"""
+	Segment an image without the GUI and save the mask in the format of the 's' key.
+
+	Parameters:
+	in_path (str): The image path.
+	out_path (str): The mask path.
+	seed_path (str): The seed mask path, see seed_mask. If None, rect is used.
+	rect (tuple): The (x, y, w, h) rectangle around the subject.
+	iters (int): The number of GrabCut iterations.
+	scale (float): Run coarse-to-fine at this scale if below 1, see grabcut_multires.
+	seed_format (str): The format of the seed mask, 'binary' or 'labels', see seed_mask.
+
+	Returns:
+	tuple: The seconds taken and the fraction of foreground pixels.
+	"""
+	start = time.perf_counter()
+	# GrabCut initialises its models with k-means on the OpenCV RNG, seed it so results do not depend on the worker
+	cv.setRNGSeed(0)
+	img = cv.imread(in_path)
+	if img is None:
+		raise IOError("Cannot read " + in_path)
+	bgdmodel = np.zeros((1, 65), np.float64)
+	fgdmodel = np.zeros((1, 65), np.float64)
+	if seed_path is not None:
+		seed = cv.imread(seed_path, cv.IMREAD_GRAYSCALE)
+		if seed is None or seed.shape != img.shape[:2]:
+			raise IOError("Missing or mismatched seed mask " + seed_path)
+		mask = seed_mask(seed, seed_format)
+		first = cv.GC_INIT_WITH_MASK
+	else:
+		mask = np.zeros(img.shape[:2], np.uint8)
+		first = cv.GC_INIT_WITH_RECT
+	for i in range(iters):
+		mode = first if i == 0 else cv.GC_EVAL
+		if scale < 1:
+			grabcut_multires(img, mask, rect, bgdmodel, fgdmodel, mode, scale)
+		else:
+			cv.grabCut(img, mask, rect, bgdmodel, fgdmodel, 1, mode)
+	fg = (mask==1) + (mask==3)
+	cv.imwrite(out_path, np.where(fg, 255, 0).astype('uint8'))
+	return time.perf_counter() - start, fg.mean()
+
+def	batch(in_dir, out_dir, seed_dir=None, rect=None, iters=5, scale=1.0, workers=None, force=False, seed_format='binary'):
+	"""
+	Segment every .jpg and .png image of a directory across a process pool, printing the time taken per image.
+	Each image is seeded by the mask with the same name in seed_dir (or the same name with a .png extension),
+	or by rect if it has none.
+
+	Parameters:
+	in_dir (str): The image directory, walked in sorted order.
+	out_dir (str): The mask directory, masks are saved under the image file names.
+	seed_dir (str): The seed mask directory.
+	rect (tuple): The (x, y, w, h) rectangle for images without a seed mask.
+	iters (int): The number of GrabCut iterations per image.
+	scale (float): Run coarse-to-fine at this scale if below 1.
+	workers (int): The number of worker processes, defaults to the number of cores.
+	force (bool): Whether to overwrite existing masks, e.g. hand-corrected ones.
+	seed_format (str): The format of the seed masks, 'binary' or 'labels', see seed_mask.
+
+	Returns:
+	list: The images that failed or came out with an empty or full mask, to be corrected by hand.
+	"""
+	os.makedirs(out_dir, exist_ok=True)
+	jobs = []
+	for root, dirs, files in os.walk(in_dir):
+		dirs.sort()
+		for file in sorted(files):
+			if not (file.endswith('.jpg') or file.endswith('.png')):
+				continue
+			out_path = os.path.join(out_dir, file)
+			if os.path.exists(out_path) and not force:
+				continue
+			seed_path = None
+			if seed_dir is not None:
+				for name in (file, os.path.splitext(file)[0] + '.png'):
+					if os.path.isfile(os.path.join(seed_dir, name)):
+						seed_path = os.path.join(seed_dir, name)
+						break
+			if seed_path is None and rect is None:
+				print("%s: no seed mask or rectangle, skipped" % file)
+				continue
+			jobs.append((os.path.join(root, file), out_path, seed_path))
+
+	failures = []
+	start = time.perf_counter()
+	with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+		futures = {executor.submit(segment_file, in_path, out_path, seed_path, rect, iters, scale, seed_format): in_path
+				   for in_path, out_path, seed_path in jobs}
+		for future in concurrent.futures.as_completed(futures):
+			in_path = futures[future]
+			try:
+				seconds, fg = future.result()
+			except Exception as e:
+				print("%s: failed, %s" % (in_path, e))
+				failures.append(in_path)
+				continue
+			print("%s: %.2f s, %.1f%% foreground" % (in_path, seconds, 100 * fg))
+			if fg == 0 or fg == 1:
+				failures.append(in_path)
+	elapsed = time.perf_counter() - start
+	print("Segmented %d images in %.1f s (%.2f images/s), %d to check" % (len(jobs), elapsed, len(jobs) / max(elapsed, 1e-9), len(failures)))
+	for in_path in sorted(failures):
+		print("  " + in_path)
+	return sorted(failures)
+
+class GrabcutJob():
+	"""
+	GrabCut iterations on a snapshot of the mask and models, run on a background thread so that
+	the windows stay responsive. A cancelled job stops at the next iteration.
+	"""
+
+	def	__init__(self, step, mask, bgdmodel, fgdmodel, modes):
+		self.mask = mask.copy()
+		self.bgdmodel = bgdmodel.copy()
+		self.fgdmodel = fgdmodel.copy()
+		self.modes = modes					# GrabCut mode of each iteration
+		self.iters_done = 0
+		self.start = time.perf_counter()
+		self.failed = False
+		self.cancelled = threading.Event()
+		self.finished = threading.Event()
+		self.thread = threading.Thread(target=self.work, args=(step,), daemon=True)
+		self.thread.start()
+
+	def	work(self, step):
+		try:
+			for mode in self.modes:
+				if self.cancelled.is_set():
+					return
+				step(self.mask, self.bgdmodel, self.fgdmodel, mode)
+				self.iters_done += 1
+		except:
+			import traceback
+			traceback.print_exc()
+			self.failed = True
+		finally:
+			self.finished.set()
+
+	def	cancel(self):
+		self.cancelled.set()
+
+	def	progress(self):
+		return "%d/%d iterations, %.1f s" % (self.iters_done, len(self.modes), time.perf_counter() - self.start)
 
 class App():
 	BLUE = [255,0,0]		# rectangle	color
@@ -57,10 +315,22 @@ class App():
 	thickness =	5			# brush	thickness
 	
 	mouse_prev = (-1, -1)
+	input_dirty = True		# input window needs redrawing
+	output_rect = None		# region (x0, y0, x1, y1) of the preview to recompute
+	poll_ms = 30			# waitKey timeout, nothing is redrawn while idle
+	resubmit = False		# run the cancelled job again after the current stroke
+
+	def	__init__(self, propagate=False, scale=1.0, iters=1):
+		self.propagate = propagate	# seed each image with the mask and models of the previous one
+		self.scale = scale			# coarse-to-fine GrabCut at this scale, 1 for full resolution only
+		self.prev = None			# (mask, bgdmodel, fgdmodel) of the last image
+		self.iters = iters			# GrabCut iterations per 'n'
+		self.job = None				# GrabcutJob in progress
 
 	def	onmouse(self, event, x,	y, flags, param):
 		# Draw Rectangle
 		if event ==	cv.EVENT_RBUTTONDOWN:
+			self.cancel_job()
 			self.rectangle = True
 			self.ix, self.iy = x,y
 
@@ -68,6 +338,7 @@ class App():
 			if self.rectangle == True:
 				self.img = self.img2.copy()
 				cv.rectangle(self.img, (self.ix, self.iy), (x, y), self.BLUE, 2)
+				self.input_dirty = True
 				self.rect =	(min(self.ix, x), min(self.iy, y), abs(self.ix - x), abs(self.iy - y))
 				self.rect_or_mask =	0
 
@@ -75,23 +346,41 @@ class App():
 			self.rectangle = False
 			self.rect_over = True
 			cv.rectangle(self.img, (self.ix, self.iy), (x, y), self.BLUE, 2)
+			self.input_dirty = True
 			self.rect =	(min(self.ix, x), min(self.iy, y), abs(self.ix - x), abs(self.iy - y))
 			self.rect_or_mask =	0
+			if self.propagated and self.rect[2] > 0 and self.rect[3] > 0:
+				self.rerect()
 			print("Press N to iterate grabcut. Use 0, 1, 2, 3 to refine segmentation by drawing.")
 
 		# draw touchup curves
 
 		if event ==	cv.EVENT_LBUTTONDOWN:
 			if self.rect_over:
+				if self.job is not None:
+					# the running job segments a stale mask
+					self.cancel_job()
+					self.resubmit = True
+					if self.rect_or_mask == 0:
+						# the first job starts from the rect, carry it into the mask so the stroke is not
+						# overwritten by GC_INIT_WITH_RECT when the job is submitted again
+						self.mask[:] = cv.GC_BGD
+						rx, ry, rw, rh = self.rect
+						self.mask[ry:ry + rh, rx:rx + rw] = cv.GC_PR_FGD
+						self.rect_or_mask = 1
+						self.models_ready = False
+						self.mark_all()
 				self.drawing = True
 				cv.circle(self.img,	(x,y), self.thickness, self.value['color'],	-1)
 				cv.circle(self.mask, (x,y),	self.thickness,	self.value['val'], -1)
+				self.mark_stroke((x, y), (x, y))
 				self.mouse_prev = (x, y)
 
 		elif event == cv.EVENT_MOUSEMOVE:
 			if self.drawing	== True:
 				cv.line(self.img, (x, y), self.mouse_prev, self.value['color'], self.thickness)
 				cv.line(self.mask, (x, y), self.mouse_prev, self.value['val'], self.thickness)
+				self.mark_stroke((x, y), self.mouse_prev)
 				self.mouse_prev = (x, y)
 
 		elif event == cv.EVENT_LBUTTONUP:
@@ -99,13 +388,127 @@ class App():
 				self.drawing = False
 				cv.circle(self.img,	(x,	y),	self.thickness,	self.value['color'], -1)
 				cv.circle(self.mask, (x, y), self.thickness, self.value['val'],	-1)
+				self.mark_stroke((x, y), (x, y))
+				if self.resubmit:
+					self.resubmit = False
+					self.start_job()
+
+	def	mark_stroke(self, p0, p1):
+		# grow the region of the preview to recompute by the bounding box of a stroke
+		r = self.thickness + 1
+		x0, y0 = max(min(p0[0], p1[0]) - r, 0), max(min(p0[1], p1[1]) - r, 0)
+		x1, y1 = max(p0[0], p1[0]) + r + 1, max(p0[1], p1[1]) + r + 1
+		if self.output_rect is not None:
+			x0, y0 = min(x0, self.output_rect[0]), min(y0, self.output_rect[1])
+			x1, y1 = max(x1, self.output_rect[2]), max(y1, self.output_rect[3])
+		self.output_rect = (x0, y0, x1, y1)
+		self.input_dirty = True
+
+	def	mark_all(self):
+		self.output_rect = (0, 0, self.img.shape[1], self.img.shape[0])
+		self.input_dirty = True
+
+	def	redraw(self):
+		# only recompute and show what changed since the last call
+		if self.output_rect is not None:
+			x0, y0, x1, y1 = self.output_rect
+			np.multiply(self.img2[y0:y1, x0:x1], (self.mask[y0:y1, x0:x1] & 1)[..., None], out=self.output[y0:y1, x0:x1])
+			cv.imshow('output', self.output)
+			self.output_rect = None
+		if self.input_dirty:
+			cv.imshow('input', self.img)
+			self.input_dirty = False
+
+	def	reset(self, propagate=False):
+		self.cancel_job()
+		self.resubmit = False
+		self.rect =	(0,0,1,1)
+		self.drawing = False
+		self.rectangle = False
+		self.rect_or_mask =	100
+		self.rect_over = False
+		self.value = self.DRAW_FG
+		self.img = self.img2.copy()
+		self.mask =	np.zeros(self.img.shape[:2], dtype = np.uint8) # mask initialized to PR_BG
+		self.output	= np.zeros(self.img.shape, np.uint8)		   # output	image to be	shown
+		self.bgdmodel = np.zeros((1, 65), np.float64)
+		self.fgdmodel = np.zeros((1, 65), np.float64)
+		self.models_ready = False	# whether the models hold estimates to continue from
+		self.propagated = False		# whether the mask was seeded from the previous image
+
+		# seed with the previous image of the sequence, sure foreground becomes probable as the subject moves
+		if propagate and self.prev is not None and self.prev[0].shape == self.mask.shape:
+			mask, self.bgdmodel, self.fgdmodel = (a.copy() for a in self.prev)
+			self.mask = np.where(mask == cv.GC_FGD, cv.GC_PR_FGD, mask).astype(np.uint8)
+			self.rect_or_mask = 1
+			self.rect_over = True
+			self.models_ready = True
+			self.propagated = True
+			print("Propagated mask from the previous image, press N to iterate grabcut. Draw a new rectangle if the subject left the old one.")
+		self.mark_all()
+
+	def	rerect(self):
+		# move the sure background of a propagated mask outside the new rectangle, keeping the seeds inside it
+		x, y, w, h = self.rect
+		inside = np.zeros(self.mask.shape, bool)
+		inside[y:y + h, x:x + w] = True
+		self.mask[inside & (self.mask == cv.GC_BGD)] = cv.GC_PR_BGD
+		self.mask[~inside] = cv.GC_BGD
+		self.rect_or_mask = 1
+		self.mark_all()
+
+	@staticmethod
+	def	grabcut(img, scale, mask, bgdmodel, fgdmodel, rect, mode):
+		if scale < 1:
+			grabcut_multires(img, mask, rect, bgdmodel, fgdmodel, mode, scale)
+		else:
+			cv.grabCut(img, mask, rect, bgdmodel, fgdmodel, 1, mode)
+
+	def	start_job(self):
+		# segment a snapshot of the mask on a worker thread, the result is published by poll_job
+		if self.rect_or_mask == 0:			# grabcut with rect
+			first = cv.GC_INIT_WITH_RECT
+		elif self.rect_or_mask == 1:		# grabcut with mask
+			# continue from the models of the last iteration instead of re-estimating them
+			first = cv.GC_EVAL if self.models_ready else cv.GC_INIT_WITH_MASK
+		else:
+			return
+		self.cancel_job()
+		# the worker only sees these snapshots, not the App, which the UI thread keeps changing
+		img2, scale, rect = self.img2, self.scale, self.rect
+		step = lambda mask, bgdmodel, fgdmodel, mode: App.grabcut(img2, scale, mask, bgdmodel, fgdmodel, rect, mode)
+		self.job = GrabcutJob(step, self.mask, self.bgdmodel, self.fgdmodel, [first] + [cv.GC_EVAL] * (self.iters - 1))
+
+	def	cancel_job(self):
+		# an iteration cannot be interrupted, so a cancelled job finishes it in the background and is dropped
+		if self.job is not None:
+			self.job.cancel()
+			self.job = None
+			cv.setWindowTitle('output', "Applied Mask Preview")
+
+	def	poll_job(self):
+		# publish the result of a finished job, or show the progress of a running one
+		job = self.job
+		if job is None:
+			return
+		if not job.finished.is_set():
+			cv.setWindowTitle('output', "Applied Mask Preview - segmenting, " + job.progress())
+			return
+		self.job = None
+		cv.setWindowTitle('output', "Applied Mask Preview")
+		if job.failed:
+			return
+		self.mask, self.bgdmodel, self.fgdmodel = job.mask, job.bgdmodel, job.fgdmodel
+		self.rect_or_mask = 1
+		self.models_ready = True
+		self.mark_all()
+		print("Segmented in %.1f s" % (time.perf_counter() - job.start))
 
 	def	run(self, in_path, out_path):
 		self.img = cv.imread(in_path)
 		
 		self.img2 =	self.img.copy()								  #	a copy of original image
-		self.mask =	np.zeros(self.img.shape[:2], dtype = np.uint8) # mask initialized to PR_BG
-		self.output	= np.zeros(self.img.shape, np.uint8)		   # output	image to be	shown
+		self.reset(self.propagate)
 
 		# input	and	output windows
 
@@ -116,12 +519,13 @@ class App():
 		cv.setWindowTitle('input', os.path.basename(in_path))
 		cv.setWindowTitle('output', "Applied Mask Preview")
 
-		print("Draw rectangle around subject using right mouse")
+		if not self.rect_over:
+			print("Draw rectangle around subject using right mouse")
 
 		while(1):
-			cv.imshow('output', self.output)
-			cv.imshow('input', self.img)
-			k =	cv.waitKey(1)
+			self.poll_job()
+			self.redraw()
+			k = cv.waitKey(self.poll_ms)
 
 			# key bindings
 			if k ==	27:			# esc to exit
@@ -145,31 +549,13 @@ class App():
 				cv.imwrite(out_path, np.where((self.mask==1) + (self.mask==3), 255, 0).astype('uint8'))
 				print("Saved mask")
 			elif k == ord('r'):	# reset	everything
-				self.rect =	(0,0,1,1)
-				self.drawing = False
-				self.rectangle = False
-				self.rect_or_mask =	100
-				self.rect_over = False
-				self.value = self.DRAW_FG
-				self.img = self.img2.copy()
-				self.mask =	np.zeros(self.img.shape[:2], dtype = np.uint8) # mask initialized to PR_BG
-				self.output	= np.zeros(self.img.shape, np.uint8)		   # output	image to be	shown
+				self.reset()
 			elif k == ord('n'):	# segment the image
-				try:
-					bgdmodel = np.zeros((1,	65), np.float64)
-					fgdmodel = np.zeros((1,	65), np.float64)
-					if (self.rect_or_mask == 0):		 # grabcut with	rect
-						cv.grabCut(self.img2, self.mask, self.rect,	bgdmodel, fgdmodel,	1, cv.GC_INIT_WITH_RECT)
-						self.rect_or_mask =	1
-					elif (self.rect_or_mask	== 1):		 # grabcut with	mask
-						cv.grabCut(self.img2, self.mask, self.rect,	bgdmodel, fgdmodel,	1, cv.GC_INIT_WITH_MASK)
-				except:
-					import traceback
-					traceback.print_exc()
-
-			mask2 =	np.where((self.mask==1)	+ (self.mask==3), 255, 0).astype('uint8')
-			self.output	= cv.bitwise_and(self.img2,	self.img2, mask=mask2)
+				self.start_job()
 
+		self.cancel_job()
+		if self.models_ready:
+			self.prev = (self.mask.copy(), self.bgdmodel.copy(), self.fgdmodel.copy())
 		print('Done')
 
 
@@ -179,16 +565,30 @@ if __name__	== '__main__':
 	parser.add_argument('--in', dest='in_path', required=True, help='Input file path')
 	parser.add_argument('--out', dest='out_path', required=True, help='Output file path')
 	parser.add_argument('--dir', action='store_true', help='Process directories')
+	parser.add_argument('--scale', type=float, default=1.0, help='Approximate GrabCut coarse-to-fine at this scale on high resolution images, e.g. 0.5 (faster but not identical, see README.md)')
+	parser.add_argument('--iters', type=int, default=None, help='GrabCut iterations per n key press (default 1), or per image with --batch (default 5)')
+	parser.add_argument('--propagate', action='store_true', help='Seed each image of a directory with the mask and models of the previous one')
+	parser.add_argument('--batch', action='store_true', help='Segment a directory without the GUI, from seed masks or a rectangle')
+	parser.add_argument('--seeds', default=None, help='Directory of seed masks named after the images, for --batch')
+	parser.add_argument('--seed-format', choices=['binary', 'labels'], default='binary', help='Seed masks as 0/255 masks like the saved ones (default), or as GrabCut labels 0 to 3')
+	parser.add_argument('--rect', type=int, nargs=4, default=None, metavar=('X', 'Y', 'W', 'H'), help='Rectangle around the subject for images without a seed mask, for --batch')
+	parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for --batch, defaults to the number of cores')
+	parser.add_argument('--force', action='store_true', help='Overwrite existing masks in --batch')
 	args = parser.parse_args()
 
-	if args.dir:
+	if args.batch:
+		batch(args.in_path, args.out_path, args.seeds, args.rect and tuple(args.rect), args.iters or 5,
+			  args.scale, args.workers, args.force, args.seed_format)
+	elif args.dir:
+		app = App(args.propagate, args.scale, args.iters or 1)
 		for root, dirs, files in os.walk(args.in_path):
-			for file in files:
+			dirs.sort()
+			for file in sorted(files):
 				if file.endswith('.jpg') or file.endswith('.png'):
 					in_path = os.path.join(root, file)
 					out_path = os.path.join(args.out_path, file)
-					App().run(in_path, out_path)
+					app.run(in_path, out_path)
 					cv.destroyAllWindows()
 	else:
-		App().run(args.in_path, args.out_path)
+		App(scale=args.scale, iters=args.iters or 1).run(args.in_path, args.out_path)
 		cv.destroyAllWindows()
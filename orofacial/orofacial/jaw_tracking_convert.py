@@ -1,30 +1,324 @@
+import glob
 import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def json_to_csv(jaw_json_path, jaw_csv_path):
+import numpy as np
+
+# the frame number is made of all digits in the image name, e.g. "img00305.png" -> 305
+_NON_DIGITS = re.compile(r"\D+")
+_DELIMITERS = " \t\r\n,]"
+
+def iter_json_array(f, chunk_size=1 << 20, max_element=1 << 26):
+    """
+    Iterate over the elements of a top-level JSON array without loading the whole file.
+
+    Parameters:
+    f (file): The JSON file opened in text mode.
+    chunk_size (int): The number of characters read at a time.
+    max_element (int): The maximum number of characters buffered for a single element.
+
+    Yields:
+    object: Each decoded element of the array.
+
+    Raises:
+    ValueError: If the file is not a JSON array, or an element is malformed or longer than max_element.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    # the position of buf in the file, for error messages
+    base = 0
+    started = False
+    while True:
+        # skip whitespace, and the separators between elements once inside the array
+        while pos < len(buf) and buf[pos] in (" \t\r\n," if started else " \t\r\n"):
+            pos += 1
+        error = None
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                end, error = None, e
+            # an element is only complete once a delimiter follows, e.g. "4.5" may continue as "4.5e3"
+            if end is not None and (eof or (end < len(buf) and buf[end] in _DELIMITERS)):
+                yield obj
+                pos = end
+                continue
+            # a malformed element keeps failing, so stop before the rest of the file is buffered
+            if error is not None and (eof or len(buf) - pos > max_element):
+                raise ValueError(f"Invalid JSON array element at character {base + error.pos}: {error.msg}") from error
+        if eof:
+            raise ValueError("Unterminated JSON array")
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        base += pos
+        buf = buf[pos:] + chunk
+        pos = 0
+
+def iter_jaw_rows(jaw_json_path):
+    """
+    Iterate over the labelled jaw positions of a JSON file.
+
+    Parameters:
+    jaw_json_path (str): The path to the input JSON file.
+
+    Yields:
+    tuple: (frame, x, y) for each image with a jaw label.
+    """
+    with open(jaw_json_path) as jaw_json_file:
+        for row in iter_json_array(jaw_json_file):
+            jaw = row['labels']['jaw']
+            if len(jaw) == 2:
+                yield int(_NON_DIGITS.sub("", row['image'])), jaw[1], jaw[0]
+
+def json_to_csv(jaw_json_path, jaw_csv_path, buffer_rows=4096):
     """
     Convert jaw tracking data from JSON to CSV.
+    The JSON file is read incrementally, so memory use does not grow with the file.
     
     Parameters:
     jaw_json_path (str): The path to the input JSON file.
     jaw_csv_path (str): The path to the output CSV file.
+    buffer_rows (int): The number of rows written to the CSV at a time.
 
     Returns:
     None
     """
-    with open(jaw_json_path) as jaw_json_file:
-        jaw_json = json.load(jaw_json_file)
+    with open(jaw_csv_path, "w") as jaw_csv:
+        jaw_csv.write("Frame X Y Probability\n")
+        lines = []
+        for frame, x, y in iter_jaw_rows(jaw_json_path):
+            lines.append(f"{frame} {x} {y} 1.00\n")
+            if len(lines) >= buffer_rows:
+                jaw_csv.write("".join(lines))
+                lines.clear()
+        jaw_csv.write("".join(lines))
+
+def json_to_npz(jaw_json_path, jaw_npz_path):
+    """
+    Convert jaw tracking data from JSON to a NumPy .npz file with one array per column.
+
+    Parameters:
+    jaw_json_path (str): The path to the input JSON file.
+    jaw_npz_path (str): The path to the output .npz file.
+
+    Returns:
+    None
+    """
+    frames, xs, ys = [], [], []
+    for frame, x, y in iter_jaw_rows(jaw_json_path):
+        frames.append(frame)
+        xs.append(x)
+        ys.append(y)
+    np.savez(
+        jaw_npz_path,
+        frame=np.array(frames, dtype=np.int64),
+        x=np.array(xs, dtype=np.float64),
+        y=np.array(ys, dtype=np.float64),
+        probability=np.ones(len(frames), dtype=np.float32),
+    )
+
+class JawTrace():
+    def __init__(self, frames, x, y, probability=None):
+        """
+        Construct a JawTrace, the jaw position at each labelled frame, sorted by frame number.
+
+        Parameters:
+        frames (numpy.ndarray): The frame numbers.
+        x (numpy.ndarray): The x coordinate of the jaw at each frame.
+        y (numpy.ndarray): The y coordinate of the jaw at each frame.
+        probability (numpy.ndarray): The label probability at each frame, defaults to 1.
+
+        Returns:
+        JawTrace: The constructed JawTrace object.
+        """
+        frames = np.asarray(frames, dtype=np.int64)
+        order = np.argsort(frames, kind="stable")
+        self.frames = frames[order]
+        self.x = np.asarray(x, dtype=np.float64)[order]
+        self.y = np.asarray(y, dtype=np.float64)[order]
+        if probability is None:
+            probability = np.ones(len(frames), dtype=np.float32)
+        self.probability = np.asarray(probability, dtype=np.float32)[order]
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a JawTrace from a file written by json_to_csv or json_to_npz.
+
+        Parameters:
+        path (str): The path to the .csv or .npz file.
+
+        Returns:
+        JawTrace: The loaded JawTrace object.
+        """
+        if path.endswith(".npz"):
+            with np.load(path) as data:
+                return cls(data["frame"], data["x"], data["y"], data["probability"])
+        data = np.loadtxt(path, skiprows=1, ndmin=2)
+        if len(data) == 0:
+            data = np.zeros((0, 4))
+        return cls(data[:, 0], data[:, 1], data[:, 2], data[:, 3])
+
+    def __len__(self):
+        return len(self.frames)
+
+    def lookup(self, frame):
+        """
+        Find the jaw position at a frame with a binary search.
+
+        Parameters:
+        frame (int): The frame number.
+
+        Returns:
+        tuple: (x, y) at the frame, or None if the frame is not labelled.
+        """
+        i = np.searchsorted(self.frames, frame)
+        if i < len(self.frames) and self.frames[i] == frame:
+            return self.x[i], self.y[i]
+        return None
+
+    def align(self, frames, method="exact", max_gap=None):
+        """
+        Get the jaw position at each of the given frames, e.g. the frames of a TongueArchive.
+
+        Parameters:
+        frames (numpy.ndarray): The frame numbers to align to.
+        method (str): "exact" only uses labelled frames, "nearest" takes the closest labelled frame
+        and "linear" interpolates between the labelled frames around each frame.
+        max_gap (int): For "nearest" and "linear", leave frames farther than this from a label
+        ("nearest") or between labels farther apart than this ("linear") unaligned.
+
+        Returns:
+        numpy.ndarray: Array of shape (len(frames), 2) of (x, y), NaN for frames without a position.
+        """
+        if method not in ("exact", "nearest", "linear"):
+            raise ValueError(f"Unknown method {method!r}, expected 'exact', 'nearest' or 'linear'")
+        frames = np.asarray(frames, dtype=np.int64)
+        ans = np.full((len(frames), 2), np.nan)
+        n = len(self.frames)
+        if n == 0:
+            return ans
+
+        idx = np.searchsorted(self.frames, frames)
+        hi = np.minimum(idx, n - 1)
+        lo = np.maximum(idx - 1, 0)
+        exact = self.frames[hi] == frames
+
+        if method == "exact":
+            ans[exact, 0] = self.x[hi[exact]]
+            ans[exact, 1] = self.y[hi[exact]]
+        elif method == "nearest":
+            pick = np.where(np.abs(self.frames[hi] - frames) < np.abs(frames - self.frames[lo]), hi, lo)
+            pick[exact] = hi[exact]
+            ans[:, 0] = self.x[pick]
+            ans[:, 1] = self.y[pick]
+            if max_gap is not None:
+                ans[np.abs(self.frames[pick] - frames) > max_gap] = np.nan
+        else:
+            inside = (frames >= self.frames[0]) & (frames <= self.frames[-1])
+            ans[inside, 0] = np.interp(frames[inside], self.frames, self.x)
+            ans[inside, 1] = np.interp(frames[inside], self.frames, self.y)
+            if max_gap is not None:
+                ans[~exact & (self.frames[hi] - self.frames[lo] > max_gap)] = np.nan
+        return ans
+
+def _convert_one(jaw_json_path, out_path, fmt):
+    """
+    Convert a single file, for use in a worker process. The output is written to a temporary
+    file first, so that a failed conversion does not leave an up to date looking output behind.
+
+    Returns:
+    float: The time taken in seconds.
+    """
+    start = time.perf_counter()
+    tmp_path = out_path + ".tmp"
+    try:
+        if fmt == "npz":
+            # np.savez appends .npz to paths without it
+            with open(tmp_path, "wb") as f:
+                json_to_npz(jaw_json_path, f)
+        else:
+            json_to_csv(jaw_json_path, tmp_path)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return time.perf_counter() - start
+
+def convert_tree(root, fmt="csv", workers=None, force=False, verbose=True):
+    """
+    Convert every jaw tracking JSON file under a directory, in parallel over a process pool.
+    Each output is written next to its JSON file with the extension of fmt. Files whose
+    output is newer than the JSON file are skipped.
+
+    Parameters:
+    root (str): The directory searched recursively for .json files.
+    fmt (str): The output format, "csv" or "npz".
+    workers (int): The number of worker processes, defaults to the number of CPUs.
+    force (bool): Convert all files, even if their output is up to date.
+    verbose (bool): Print the throughput of each file as it finishes.
+
+    Returns:
+    dict: Mapping of each JSON path to "converted", "skipped" or the error message.
+    """
+    results = {}
+    jobs = []
+    for jaw_json_path in sorted(glob.glob(os.path.join(root, "**", "*.json"), recursive=True)):
+        out_path = jaw_json_path[:-len(".json")] + "." + fmt
+        if not force and os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(jaw_json_path):
+            results[jaw_json_path] = "skipped"
+        else:
+            jobs.append((jaw_json_path, out_path))
 
-        with open(jaw_csv_path, "w") as jaw_csv:
-            jaw_csv.write("Frame X Y Probability\n")
-            for row in jaw_json:
-                if len(row['labels']['jaw']) == 2:
-                    jaw_csv.write(f"{int(''.join(filter(str.isdigit, row['image'])))} ")
-                    jaw_csv.write(f"{row['labels']['jaw'][1]} {row['labels']['jaw'][0]} 1.00\n")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_convert_one, path, out_path, fmt): path for path, out_path in jobs}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                seconds = future.result()
+            except Exception as e:
+                results[path] = f"{type(e).__name__}: {e}"
+                if verbose:
+                    print(f"Failed {path}: {results[path]}")
+                continue
+            results[path] = "converted"
+            if verbose:
+                mb = os.path.getsize(path) / 1e6
+                print(f"Converted {path} ({mb:.1f} MB in {seconds:.2f} s, {mb / max(seconds, 1e-9):.1f} MB/s)")
+    return results
 
 if __name__ == "__main__":
     import argparse
+    import sys
     parser = argparse.ArgumentParser(description="Convert jaw tracking data from JSON to CSV.")
-    parser.add_argument("--in", required=True, help="Input JSON file path")
-    parser.add_argument("--out", required=True, help="Output CSV file path")
+    parser.add_argument("--in", dest="input", required=True, help="Input JSON file path, or directory with --dir")
+    parser.add_argument("--out", dest="output", help="Output file path, not used with --dir")
+    parser.add_argument("--format", choices=["csv", "npz"], default="csv", help="Output format")
+    parser.add_argument("--dir", action="store_true", help="Convert every JSON file under the input directory")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes with --dir")
+    parser.add_argument("--force", action="store_true", help="Convert files whose output is up to date with --dir")
     args = parser.parse_args()
-    json_to_csv(args.input, args.output)
+    if args.dir:
+        start = time.perf_counter()
+        results = convert_tree(args.input, args.format, args.workers, args.force)
+        statuses = list(results.values())
+        failed = len(statuses) - statuses.count("converted") - statuses.count("skipped")
+        print(f"{statuses.count('converted')} converted, {statuses.count('skipped')} skipped, {failed} failed in {time.perf_counter() - start:.1f} s")
+        sys.exit(1 if failed else 0)
+    if args.output is None:
+        parser.error("--out is required without --dir")
+    if args.format == "npz":
+        json_to_npz(args.input, args.output)
+    else:
+        json_to_csv(args.input, args.output)
@@ -0,0 +1,317 @@
+import numpy as np
+
+def segment_licks(frames, coords, min_len=1, max_gap=1):
+    """
+    Split tongue tip coordinates into licks, where a new lick starts at each gap in frame numbers.
+    The archive only contains frames where the tongue is visible, so gaps separate licks.
+
+    Parameters:
+    frames (numpy.ndarray): The frame number of each coordinate, shape (n,).
+    coords (numpy.ndarray): The tongue tip coordinates of shape (n, 2), e.g. from track_archive.
+    Rows with NaN (untracked frames) are dropped before splitting.
+    min_len (int): Licks with fewer points than this are dropped.
+    max_gap (int): Consecutive frames further apart than this start a new lick.
+
+    Returns:
+    tuple: (offsets, frames, coords) where lick i is coords[offsets[i]:offsets[i+1]] with
+    frame numbers frames[offsets[i]:offsets[i+1]].
+    """
+    frames = np.asarray(frames, dtype=np.int64)
+    coords = np.asarray(coords, dtype=np.float32)
+    valid = ~np.isnan(coords).any(axis=1)
+    frames, coords = frames[valid], coords[valid]
+
+    starts = np.flatnonzero(np.diff(frames) > max_gap) + 1
+    if len(frames):
+        starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.append(starts, len(frames)))
+    if min_len > 1:
+        keep = lengths >= min_len
+        point_keep = np.repeat(keep, lengths)
+        frames, coords, lengths = frames[point_keep], coords[point_keep], lengths[keep]
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets, frames, np.ascontiguousarray(coords)
+
+def lick_stats(offsets, frames, coords, direction=None):
+    """
+    Compute per-lick statistics of licks from segment_licks.
+
+    Parameters:
+    offsets (numpy.ndarray): The lick offsets, shape (n_licks+1,).
+    frames (numpy.ndarray): The frame number of each point.
+    coords (numpy.ndarray): The coordinates of each point, shape (n, 2).
+    direction (numpy.ndarray): Direction of protrusion, e.g. the init_vec used for tracking.
+    If not given, protrusion is the distance from the first point of the lick.
+
+    Returns:
+    dict: Arrays of shape (n_licks,) with keys "start_frame", "duration" (in frames), "n_points",
+    "path_length" and "max_protrusion" (largest displacement from the first point of the lick).
+    """
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    n_licks = len(lengths)
+    stats = {
+        "start_frame": frames[starts] if n_licks else np.zeros(0, dtype=np.int64),
+        "duration": frames[offsets[1:] - 1] - frames[starts] + 1 if n_licks else np.zeros(0, dtype=np.int64),
+        "n_points": lengths,
+        "path_length": np.zeros(n_licks, dtype=np.float32),
+        "max_protrusion": np.zeros(n_licks, dtype=np.float32),
+    }
+    if n_licks == 0:
+        return stats
+
+    # length of the step into each point, zero at the first point of each lick
+    steps = np.zeros(len(coords), dtype=np.float32)
+    steps[1:] = np.linalg.norm(np.diff(coords, axis=0), axis=1)
+    steps[starts] = 0
+    stats["path_length"] = np.add.reduceat(steps, starts)
+
+    rel = coords - np.repeat(coords[starts], lengths, axis=0)
+    if direction is None:
+        protrusion = np.linalg.norm(rel, axis=1)
+    else:
+        direction = np.asarray(direction, dtype=np.float32)
+        protrusion = rel @ (direction / np.linalg.norm(direction))
+    stats["max_protrusion"] = np.maximum.reduceat(protrusion, starts)
+    return stats
+
+def dedup_licks(offsets, coords, tol=1e-3):
+    """
+    Remove points that are within tol of the previous point of the same lick,
+    as required by spline fitting.
+
+    Parameters:
+    offsets (numpy.ndarray): The lick offsets, shape (n_licks+1,).
+    coords (numpy.ndarray): The coordinates of each point, shape (n, 2).
+    tol (float): Points closer than this to the previous point are removed.
+
+    Returns:
+    tuple: (offsets, keep) with the new lick offsets and the boolean mask of kept points.
+    """
+    keep = np.ones(len(coords), dtype=np.bool_)
+    keep[1:] = np.linalg.norm(np.diff(coords, axis=0), axis=1) > tol
+    keep[offsets[:-1][np.diff(offsets) > 0]] = True
+
+    kept_before = np.zeros(len(coords) + 1, dtype=np.int64)
+    np.cumsum(keep, out=kept_before[1:])
+    return kept_before[offsets], keep
+
+def resample_licks(offsets, coords, k=100, method="linear", min_points=4, tol=1e-3):
+    """
+    Resample every lick to k points evenly spaced along its path, so that licks can be averaged
+    with np.mean(axis=0). Duplicate points are removed first and short licks are dropped.
+
+    Parameters:
+    offsets (numpy.ndarray): The lick offsets from segment_licks, shape (n_licks+1,).
+    coords (numpy.ndarray): The coordinates of each point, shape (n, 2).
+    k (int): The number of points per resampled lick.
+    method (str): "linear" resamples all licks in one vectorized pass along their arc length,
+    "spline" fits a cubic spline per lick with scipy.interpolate.splprep.
+    min_points (int): Licks with fewer points than this after removing duplicates are dropped.
+    tol (float): Points closer than this to the previous point are duplicates.
+
+    Returns:
+    tuple: (paths, lick_idx) where paths is the array of shape (n_kept, k, 2) and lick_idx
+    the index of each kept lick in offsets.
+    """
+    if method not in ("linear", "spline"):
+        raise ValueError(f"Unknown method {method!r}, expected 'linear' or 'spline'")
+    coords = np.asarray(coords, dtype=np.float64)
+    offsets, keep = dedup_licks(offsets, coords, tol)
+    coords = coords[keep]
+
+    lengths = np.diff(offsets)
+    long_enough = lengths >= max(min_points, 2)
+    lick_idx = np.flatnonzero(long_enough)
+    paths = np.zeros((len(lick_idx), k, 2), dtype=np.float32)
+    if len(lick_idx) == 0:
+        return paths, lick_idx
+    t = np.linspace(0, 1, k)
+
+    if method == "spline":
+        from scipy import interpolate
+        for i, lick in enumerate(lick_idx):
+            tck, u = interpolate.splprep(coords[offsets[lick]:offsets[lick + 1]].T, s=0, k=3)
+            paths[i] = np.column_stack(interpolate.splev(t, tck))
+        return paths, lick_idx
+
+    coords, lengths = coords[np.repeat(long_enough, lengths)], lengths[lick_idx]
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+
+    # normalized arc length of each point within its lick, shifted by 2 per lick so that
+    # a single searchsorted finds the segment of every target point of every lick
+    steps = np.zeros(len(coords))
+    steps[1:] = np.linalg.norm(np.diff(coords, axis=0), axis=1)
+    steps[starts] = 0
+    arc = np.cumsum(steps)
+    arc -= np.repeat(arc[starts], lengths)
+    total = arc[starts + lengths - 1]
+    key = arc / np.repeat(total, lengths) + np.repeat(2.0 * np.arange(len(lengths)), lengths)
+
+    target = (t[None, :] + 2.0 * np.arange(len(lengths))[:, None]).ravel()
+    seg = np.searchsorted(key, target, side="right") - 1
+    seg = np.clip(seg, np.repeat(starts, k), np.repeat(starts + lengths - 2, k))
+    w = ((target - key[seg]) / (key[seg + 1] - key[seg]))[:, None]
+    paths[:] = ((1 - w) * coords[seg] + w * coords[seg + 1]).reshape(len(lengths), k, 2)
+    return paths, lick_idx
+
+def rasterize_paths(paths, shape=(480, 640), scale=(640/256, 480/256), resolution=20, out=None):
+    """
+    Accumulate a heatmap of lick paths. Each segment between consecutive points of a path is
+    sampled at resolution points per pixel of its longest side (in path coordinates), and each
+    sample adds 1 to the pixel it falls in. All segments of all paths are sampled at once and
+    accumulated with np.bincount. Samples outside the heatmap are clipped to its edge after rounding,
+    whereas interpolate_and_update_heatmap in the notebooks clips to 638/478 before rounding and so
+    never fills the last row and column; inside the border both give the same counts.
+
+    Parameters:
+    paths (numpy.ndarray): The paths of shape (n_paths, k, 2) as (x, y), e.g. from resample_licks.
+    shape (tuple): The (height, width) of the heatmap.
+    scale (tuple): The (x, y) factors from path coordinates to heatmap pixels, by default from
+    the 256x256 tracking images to the 640x480 video.
+    resolution (float): The number of samples per unit of segment length.
+    out (numpy.ndarray): Optional heatmap of the given shape to add to.
+
+    Returns:
+    numpy.ndarray: The heatmap of shape (height, width), indexed [y, x].
+    """
+    if out is None:
+        out = np.zeros(shape)
+    paths = np.asarray(paths, dtype=np.float64)
+    if paths.size == 0:
+        return out
+
+    start = paths[:, :-1].reshape(-1, 2)
+    delta = paths[:, 1:].reshape(-1, 2) - start
+    n_samples = (np.abs(delta).max(axis=1) * resolution).astype(np.int64)
+
+    seg = np.repeat(np.arange(len(start)), n_samples)
+    seg_start = np.zeros(len(start), dtype=np.int64)
+    np.cumsum(n_samples[:-1], out=seg_start[1:])
+    # samples run from the start to the end of the segment, both included
+    step = np.arange(len(seg)) - seg_start[seg]
+    t = step / np.maximum(n_samples[seg] - 1, 1)
+    points = start[seg] + t[:, None] * delta[seg]
+
+    x = np.clip(np.round(points[:, 0] * scale[0]), 0, shape[1] - 1).astype(np.int64)
+    y = np.clip(np.round(points[:, 1] * scale[1]), 0, shape[0] - 1).astype(np.int64)
+    out += np.bincount(y * shape[1] + x, minlength=shape[0] * shape[1]).reshape(shape)
+    return out
+
+class HeatmapAccumulator():
+    def __init__(self, shape=(480, 640), range=((0, 256), (0, 256))):
+        """
+        Construct a HeatmapAccumulator, a heatmap on a fixed grid that can be updated incrementally
+        and merged with others, e.g. to build cohort maps from per-session results.
+
+        Parameters:
+        shape (tuple): The (height, width) of the heatmap.
+        range (tuple): The ((x_min, x_max), (y_min, y_max)) of the input coordinates covered by the grid,
+        by default the 256x256 tracking images.
+
+        Returns:
+        HeatmapAccumulator: The constructed, empty HeatmapAccumulator object.
+        """
+        self.shape = tuple(int(s) for s in shape)
+        self.range = tuple(tuple(float(v) for v in r) for r in range)
+        self.counts = np.zeros(self.shape)
+        self.n_items = 0
+
+    def _scale(self):
+        (x0, x1), (y0, y1) = self.range
+        return self.shape[1] / (x1 - x0), self.shape[0] / (y1 - y0)
+
+    def update(self, coords, where=None):
+        """
+        Add points, e.g. tongue tip positions, like np.histogram2d over the grid.
+        NaN points and points outside the range are ignored.
+
+        Parameters:
+        coords (numpy.ndarray): The points of shape (n, 2) as (x, y).
+        where (callable): Optional predicate on coords returning a boolean mask of the points to add.
+
+        Returns:
+        HeatmapAccumulator: self.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if where is not None:
+            coords = coords[where(coords)]
+        (x0, x1), (y0, y1) = self.range
+        sx, sy = self._scale()
+        x, y = coords[:, 0], coords[:, 1]
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        # like np.histogram2d, the right edge belongs to the last bin
+        col = np.minimum(((x[inside] - x0) * sx).astype(np.int64), self.shape[1] - 1)
+        row = np.minimum(((y[inside] - y0) * sy).astype(np.int64), self.shape[0] - 1)
+        self.counts += np.bincount(row * self.shape[1] + col, minlength=self.counts.size).reshape(self.shape)
+        self.n_items += int(inside.sum())
+        return self
+
+    def update_paths(self, paths, resolution=20, where=None):
+        """
+        Add lick paths with rasterize_paths.
+
+        Parameters:
+        paths (numpy.ndarray): The paths of shape (n_paths, k, 2) as (x, y), e.g. from resample_licks.
+        resolution (float): The number of samples per unit of segment length.
+        where (callable): Optional predicate on paths returning a boolean mask of the paths to add,
+        e.g. lambda p: p[:, :, 1].max(axis=1) > 170 for licks reaching below y = 170.
+
+        Returns:
+        HeatmapAccumulator: self.
+        """
+        paths = np.asarray(paths, dtype=np.float64)
+        if where is not None:
+            paths = paths[where(paths)]
+        origin = np.array([self.range[0][0], self.range[1][0]])
+        rasterize_paths(paths - origin, self.shape, self._scale(), resolution, out=self.counts)
+        self.n_items += len(paths)
+        return self
+
+    def merge(self, other):
+        """
+        Add the counts of another HeatmapAccumulator on the same grid.
+
+        Parameters:
+        other (HeatmapAccumulator): The accumulator to merge into this one.
+
+        Returns:
+        HeatmapAccumulator: self.
+        """
+        if self.shape != other.shape or self.range != other.range:
+            raise ValueError(f"Cannot merge heatmaps on different grids: {self.shape} {self.range} and {other.shape} {other.range}")
+        self.counts += other.counts
+        self.n_items += other.n_items
+        return self
+
+    def save(self, path):
+        """
+        Save the heatmap to a compressed .npz file.
+
+        Parameters:
+        path (str): The output path.
+
+        Returns:
+        None
+        """
+        np.savez_compressed(path, counts=self.counts, range=np.array(self.range), n_items=self.n_items)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a heatmap saved with save.
+
+        Parameters:
+        path (str): The path to the .npz file.
+
+        Returns:
+        HeatmapAccumulator: The loaded HeatmapAccumulator object.
+        """
+        with np.load(path) as data:
+            acc = cls(data["counts"].shape, data["range"])
+            acc.counts[:] = data["counts"]
+            acc.n_items = int(data["n_items"])
+        return acc
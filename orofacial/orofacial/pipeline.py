@@ -0,0 +1,264 @@
+import contextlib
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from . import lick_analysis, tongue_mask_processing, tongue_tip_track_2D
+
+# tracking parameters used for each camera view in the trajectory notebooks
+PRESETS = {
+    "side": {"init_vec": (-1, 1), "mode": "dist", "min_pixels": 15},
+    "bottom": {"init_vec": (-1, 0), "mode": "no_dist", "min_pixels": 60},
+}
+
+# set in the flags column for frames with too few pixels to track
+FLAG_SKIPPED = 1
+
+TIPS_HEADER = "Frame X Y LickId Flags"
+TIPS_FMT = ["%d", "%.3f", "%.3f", "%d", "%d"]
+LICKS_HEADER = "LickId StartFrame Duration Points PathLength MaxProtrusion"
+
+def _background(iterable, depth=2):
+    """
+    Iterate over an iterable in a background thread, keeping at most depth items ready,
+    so that producing the next item overlaps with consuming the current one. If the consumer
+    raises or stops early, the thread stops at the next item and the generator's close()
+    waits for it.
+
+    Parameters:
+    iterable (iterable): The items to produce.
+    depth (int): The number of items produced ahead.
+
+    Yields:
+    object: The items of iterable, in order.
+    """
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # a consumer that is gone never empties the queue, so do not block on it
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except BaseException as e:
+            put((False, e))
+        finally:
+            # run the cleanup of a generator in the thread that iterated it
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = q.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def _read_chunks(archive, start, stop, chunk, img_height, img_width):
+    for lo in range(start, stop, chunk):
+        yield archive.read_stack(lo, min(lo + chunk, stop), img_height, img_width)
+
+def _track_chunks(stacks, init_vec, use_dist, min_pixels, percentile):
+    for stack in stacks:
+        tips = tongue_tip_track_2D.track_ragged(stack.offsets, stack.heights, stack.widths, init_vec, use_dist, min_pixels, percentile,
+                                                  stack.img_height, stack.img_width)
+        yield np.asarray(stack.frames, dtype=np.int64), tips
+
+def track_session(h5_path, tips_path, licks_path=None, view="side", start=0, stop=None, chunk=16384,
+                  max_gap=1, percentile=0.75, img_height=256, img_width=256, **overrides):
+    """
+    Run the tongue tip pipeline on one archive: pixel count filter, largest connected component,
+    tip tracking and lick segmentation. Reading, tracking and writing run concurrently on
+    consecutive chunks, and only the masks of the chunks in flight are held in memory.
+
+    Parameters:
+    h5_path (str): The path to the .h5 tongue archive.
+    tips_path (str): The output table of (frame, x, y, lick_id, flags) per frame, .csv (space separated,
+    written as tracking goes) or .npz (one array per column).
+    licks_path (str): Optional output table of lick_analysis.lick_stats per lick, .csv or .npz.
+    view (str): The preset in PRESETS giving init_vec, mode and min_pixels.
+    start (int): The first archive index to process.
+    stop (int): One past the last archive index to process, defaults to the end.
+    chunk (int): The number of frames per chunk.
+    max_gap (int): Consecutive tracked frames further apart than this start a new lick.
+    percentile (float): The distance percentile used in "dist" mode.
+    img_height (int): The height of the image.
+    img_width (int): The width of the image.
+    **overrides: init_vec, mode or min_pixels to use instead of the preset.
+
+    Returns:
+    int: The number of frames processed.
+    """
+    params = dict(PRESETS[view], **overrides)
+    init_vec = np.asarray(params["init_vec"], dtype=np.float32)
+    archive = tongue_mask_processing.TongueArchive(h5_path)
+    if stop is None:
+        stop = len(archive.frames)
+
+    stacks = _background(_read_chunks(archive, start, stop, chunk, img_height, img_width))
+    results = _background(_track_chunks(stacks, init_vec, params["mode"] == "dist", params["min_pixels"], percentile))
+
+    to_csv = tips_path.endswith(".csv")
+    columns = []
+    tracked_frames, tracked_coords = [], []
+    last_frame, last_id = None, -1
+    try:
+        with open(tips_path, "w") if to_csv else contextlib.nullcontext() as out:
+            if to_csv:
+                out.write(TIPS_HEADER + "\n")
+            for frames, tips in results:
+                flags = np.where(np.isnan(tips[:, 0]), FLAG_SKIPPED, 0).astype(np.int64)
+                lick_ids = assign_lick_ids(frames, flags, max_gap, last_frame, last_id)
+                tracked = flags == 0
+                if tracked.any():
+                    last_frame, last_id = frames[tracked][-1], lick_ids[tracked][-1]
+                    tracked_frames.append(frames[tracked])
+                    tracked_coords.append(tips[tracked])
+
+                if to_csv:
+                    np.savetxt(out, np.column_stack([frames, tips, lick_ids, flags]), fmt=TIPS_FMT)
+                else:
+                    columns.append((frames, tips, lick_ids, flags))
+    finally:
+        # stop the tracking and reading threads before closing the archive they read from
+        results.close()
+        stacks.close()
+        archive.f.close()
+
+    if not to_csv:
+        if not columns:
+            columns = [(np.zeros(0, dtype=np.int64), np.zeros((0, 2), dtype=np.float32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))]
+        write_tips(tips_path, *(np.concatenate(c) for c in zip(*columns)))
+
+    if licks_path is not None:
+        frames = np.concatenate(tracked_frames) if tracked_frames else np.zeros(0, dtype=np.int64)
+        coords = np.concatenate(tracked_coords) if tracked_coords else np.zeros((0, 2), dtype=np.float32)
+        write_licks(licks_path, frames, coords, init_vec, max_gap)
+    return stop - start
+
+def assign_lick_ids(frames, flags, max_gap=1, last_frame=None, last_id=-1):
+    """
+    Number the licks of a run of frames, consistently with lick_analysis.segment_licks. Tracked frames
+    further apart than max_gap start a new lick, and skipped frames get lick id -1.
+
+    Parameters:
+    frames (np.ndarray): The sorted frame numbers, shape (n,).
+    flags (np.ndarray): The flags of each frame, shape (n,).
+    max_gap (int): Consecutive tracked frames further apart than this start a new lick.
+    last_frame (int): The last tracked frame before this run, to continue licks across chunks.
+    last_id (int): The lick id of last_frame.
+
+    Returns:
+    np.ndarray: The lick id of each frame, shape (n,).
+    """
+    tracked = (flags & FLAG_SKIPPED) == 0
+    lick_ids = np.full(len(frames), -1, dtype=np.int64)
+    f = frames[tracked]
+    if len(f):
+        new_lick = np.empty(len(f), dtype=np.bool_)
+        new_lick[0] = last_frame is None or f[0] - last_frame > max_gap
+        new_lick[1:] = np.diff(f) > max_gap
+        lick_ids[tracked] = last_id + np.cumsum(new_lick)
+    return lick_ids
+
+def write_tips(tips_path, frames, tips, lick_ids, flags):
+    """
+    Write a tip table, .csv (space separated) or .npz (one array per column).
+
+    Parameters:
+    tips_path (str): The output path.
+    frames (np.ndarray): The frame numbers, shape (n,).
+    tips (np.ndarray): The tip coordinates, NaN for skipped frames, shape (n, 2).
+    lick_ids (np.ndarray): The lick ids, shape (n,).
+    flags (np.ndarray): The flags, shape (n,).
+    """
+    if tips_path.endswith(".csv"):
+        np.savetxt(tips_path, np.column_stack([frames, tips, lick_ids, flags]), fmt=TIPS_FMT, header=TIPS_HEADER, comments="")
+    else:
+        np.savez(tips_path, frame=frames, x=tips[:, 0], y=tips[:, 1], lick_id=lick_ids, flags=flags)
+
+def write_licks(licks_path, frames, coords, init_vec, max_gap=1):
+    """
+    Segment the tracked frames into licks and write lick_analysis.lick_stats per lick, .csv or .npz.
+
+    Parameters:
+    licks_path (str): The output path.
+    frames (np.ndarray): The sorted tracked frame numbers, shape (n,).
+    coords (np.ndarray): The tip coordinates of those frames, shape (n, 2).
+    init_vec (np.ndarray): The protrusion direction.
+    max_gap (int): Consecutive tracked frames further apart than this start a new lick.
+    """
+    offsets, frames, coords = lick_analysis.segment_licks(frames, coords, max_gap=max_gap)
+    stats = lick_analysis.lick_stats(offsets, frames, coords, direction=init_vec)
+    lick_ids = np.arange(len(stats["n_points"]))
+    if licks_path.endswith(".npz"):
+        np.savez(licks_path, lick_id=lick_ids, **stats)
+        return
+    table = np.column_stack([lick_ids, stats["start_frame"], stats["duration"], stats["n_points"], stats["path_length"], stats["max_protrusion"]])
+    np.savetxt(licks_path, table, fmt=["%d", "%d", "%d", "%d", "%.3f", "%.3f"], header=LICKS_HEADER, comments="")
+
+def output_paths(h5_path, out_dir=None, fmt="csv"):
+    """
+    Default output paths of an archive, e.g. session_tongue.h5 -> session_tongue_tips.csv, session_tongue_licks.csv.
+
+    Parameters:
+    h5_path (str): The path to the .h5 tongue archive.
+    out_dir (str): The output directory, defaults to the directory of the archive.
+    fmt (str): The output format, "csv" or "npz".
+
+    Returns:
+    tuple: (tips_path, licks_path)
+    """
+    name = os.path.splitext(os.path.basename(h5_path))[0]
+    out_dir = os.path.dirname(h5_path) if out_dir is None else out_dir
+    return os.path.join(out_dir, f"{name}_tips.{fmt}"), os.path.join(out_dir, f"{name}_licks.{fmt}")
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="orofacial", description="Track tongue tips and licks in .h5 tongue archives.")
+    parser.add_argument("paths", nargs="+", help="Input .h5 tongue archives")
+    parser.add_argument("--view", choices=sorted(PRESETS), default="side", help="Camera view preset")
+    parser.add_argument("--out-dir", default=None, help="Output directory, defaults to next to each archive")
+    parser.add_argument("--format", choices=["csv", "npz"], default="csv", help="Output format")
+    parser.add_argument("--chunk", type=int, default=16384, help="Frames per chunk")
+    parser.add_argument("--max-gap", type=int, default=1, help="Frame gap that starts a new lick")
+    parser.add_argument("--mode", choices=["dist", "no_dist"], default=None, help="Override the tip tracking mode of the preset")
+    parser.add_argument("--min-pixels", type=int, default=None, help="Override the pixel count threshold of the preset")
+    parser.add_argument("--init-vec", type=float, nargs=2, default=None, help="Override the initial tongue direction of the preset")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    if args.mode is not None:
+        overrides["mode"] = args.mode
+    if args.min_pixels is not None:
+        overrides["min_pixels"] = args.min_pixels
+    if args.init_vec is not None:
+        overrides["init_vec"] = args.init_vec
+
+    for path in args.paths:
+        tips_path, licks_path = output_paths(path, args.out_dir, args.format)
+        start = time.perf_counter()
+        n = track_session(path, tips_path, licks_path, view=args.view, chunk=args.chunk, max_gap=args.max_gap, **overrides)
+        seconds = time.perf_counter() - start
+        print(f"{path}: {n} frames in {seconds:.1f} s ({n / max(seconds, 1e-9):.0f} frames/s) -> {tips_path}")
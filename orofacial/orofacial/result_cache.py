@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from . import tongue_mask_processing, tongue_tip_track_2D
+
+def algorithm_version():
+    """
+    A digest of the tracking source, so that cached results are not reused after the algorithm changes.
+
+    Returns:
+    str: The first 12 hex digits of the SHA-1 of tongue_tip_track_2D.py and tongue_mask_processing.py.
+    """
+    h = hashlib.sha1()
+    for module in (tongue_tip_track_2D, tongue_mask_processing):
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:12]
+
+def file_hash(path, block_size=1 << 20):
+    """
+    The SHA-1 of a file's contents.
+
+    Parameters:
+    path (str): The path to the file.
+    block_size (int): The number of bytes read at a time.
+
+    Returns:
+    str: The hex digest.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class ResultCache():
+    """
+    An on-disk cache of tracked tongue tips. Each entry is a .npy shard named after the algorithm
+    version and a digest of the archive contents and tracking parameters, loaded memory-mapped.
+    When the shards exceed max_bytes, the least recently used ones are deleted, starting with
+    shards of other algorithm versions.
+    """
+
+    def __init__(self, root=None, max_bytes=2 << 30):
+        """
+        Parameters:
+        root (str): The cache directory, defaults to $OROFACIAL_CACHE or ~/.cache/orofacial.
+        max_bytes (int): The maximum total size of the shards.
+        """
+        if root is None:
+            root = os.environ.get("OROFACIAL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "orofacial"))
+        self.root = root
+        self.max_bytes = max_bytes
+        self.version = algorithm_version()
+        os.makedirs(root, exist_ok=True)
+
+    def archive_hash(self, path):
+        """
+        The content hash of an archive, remembered by path, size and modification time so that
+        each archive is only read once.
+
+        Parameters:
+        path (str): The path to the .h5 tongue archive.
+
+        Returns:
+        str: The hex digest.
+        """
+        index_path = os.path.join(self.root, "hashes.json")
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        entry = index.get(os.path.abspath(path))
+        if entry is not None and entry[:2] == stamp:
+            return entry[2]
+
+        digest = file_hash(path)
+        index[os.path.abspath(path)] = stamp + [digest]
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+        return digest
+
+    def key(self, path, start, stop, init_vec, mode, min_pixels, percentile, img_height=256, img_width=256):
+        """
+        The cache key of a tracking run.
+
+        Parameters:
+        path (str): The path to the .h5 tongue archive.
+        start (int): The first archive index.
+        stop (int): One past the last archive index.
+        init_vec (numpy.ndarray): The initial vector in the direction of the tongue.
+        mode (str): "dist" or "no_dist".
+        min_pixels (int): The pixel count threshold.
+        percentile (float): The distance percentile used in "dist" mode.
+        img_height (int): The height of the image.
+        img_width (int): The width of the image.
+
+        Returns:
+        str: The key, prefixed with the algorithm version.
+        """
+        params = [
+            self.archive_hash(path), int(start), int(stop), [float(v) for v in init_vec], mode, int(min_pixels), float(percentile),
+            int(img_height), int(img_width),
+        ]
+        return f"{self.version}_{hashlib.sha1(json.dumps(params).encode()).hexdigest()}"
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.npy")
+
+    def get(self, key):
+        """
+        Load a cached result.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        numpy.ndarray: The read-only memory-mapped result, or None if it is not cached.
+        """
+        path = self._path(key)
+        try:
+            result = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        # the modification time orders shards for eviction
+        os.utime(path)
+        return result
+
+    def put(self, key, result):
+        """
+        Store a result and evict old shards if the cache is over its size.
+
+        Parameters:
+        key (str): The cache key.
+        result (numpy.ndarray): The result to store.
+        """
+        path = self._path(key)
+        tmp_path = f"{path[:-len('.npy')]}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, result)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Delete shards until their total size is at most max_bytes: shards of other algorithm versions first,
+        then the least recently used.
+        """
+        shards = []
+        for name in os.listdir(self.root):
+            if name.endswith(".npy") and not name.endswith(".tmp.npy"):
+                st = os.stat(os.path.join(self.root, name))
+                shards.append((name.startswith(self.version + "_"), st.st_mtime_ns, st.st_size, name))
+        total = sum(s[2] for s in shards)
+        for current, mtime, size, name in sorted(shards):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def invalidate(self, all_versions=False):
+        """
+        Delete the shards of other algorithm versions, or every shard.
+
+        Parameters:
+        all_versions (bool): Whether to delete the shards of the current version too.
+        """
+        for name in os.listdir(self.root):
+            if name.endswith(".npy") and (all_versions or not name.startswith(self.version + "_")):
+                os.remove(os.path.join(self.root, name))
+
+def track_cached(path, init_vec, mode="dist", min_pixels=15, percentile=0.75, start=0, stop=None, cache=None, img_height=256, img_width=256, chunk=65536):
+    """
+    tongue_tip_track_2D.track_archive on a range of an archive, through a ResultCache.
+
+    Parameters:
+    path (str): The path to the .h5 tongue archive.
+    init_vec (numpy.ndarray): The initial vector in the direction of the tongue.
+    mode (str): "dist" for find_tongue_tip or "no_dist" for find_tongue_tip_no_dist.
+    min_pixels (int): Masks with this many pixels or fewer are skipped.
+    percentile (float): The distance percentile used in "dist" mode.
+    start (int): The first archive index to track.
+    stop (int): One past the last archive index to track, defaults to the end.
+    cache (ResultCache): The cache to use, defaults to ResultCache().
+    img_height (int): The height of the image.
+    img_width (int): The width of the image.
+    chunk (int): The number of frames read at a time, which does not change the result.
+
+    Returns:
+    numpy.ndarray: The tongue tip coordinates of shape (n, 2) aligned with archive.frames[start:stop],
+    NaN for skipped frames, memory-mapped when cached.
+    """
+    cache = ResultCache() if cache is None else cache
+    archive = tongue_mask_processing.TongueArchive(path)
+    try:
+        stop = len(archive.frames) if stop is None else min(stop, len(archive.frames))
+        key = cache.key(path, start, stop, init_vec, mode, min_pixels, percentile, img_height, img_width)
+        tips = cache.get(key)
+        if tips is None:
+            tips = tongue_tip_track_2D.track_archive(
+                archive, init_vec, mode, min_pixels, percentile, img_height, img_width, chunk, start=start, stop=stop
+            )
+            cache.put(key, tips)
+    finally:
+        archive.f.close()
+    return tips
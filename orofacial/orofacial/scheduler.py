@@ -0,0 +1,211 @@
+import concurrent.futures
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from . import pipeline, result_cache, tongue_mask_processing
+
+def find_archives(patterns):
+    """
+    Resolve glob patterns and manifest files to a sorted list of .h5 tongue archives.
+    A manifest is a text file with one archive path per line, relative to the manifest.
+
+    Parameters:
+    patterns (list): Glob patterns, archive paths or manifest files.
+
+    Returns:
+    list: The archive paths, without duplicates.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isfile(pattern) and not pattern.endswith(".h5"):
+            root = os.path.dirname(pattern)
+            with open(pattern) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        paths.append(os.path.join(root, line))
+        else:
+            paths.extend(glob.glob(pattern))
+    return sorted(set(paths))
+
+def plan_jobs(paths, job_frames=65536):
+    """
+    Split archives into jobs of at most job_frames frames, so that large sessions are spread across workers.
+
+    Parameters:
+    paths (list): The archive paths.
+    job_frames (int): The maximum number of frames per job.
+
+    Returns:
+    list: (path, start, stop) per job, in archive order. An empty archive gets one empty job,
+    so that it still gets (empty) output tables.
+    """
+    jobs = []
+    for path in paths:
+        archive = tongue_mask_processing.TongueArchive(path)
+        n = len(archive.frames)
+        archive.f.close()
+        jobs.extend((path, start, min(start + job_frames, n)) for start in range(0, max(n, 1), job_frames))
+    return jobs
+
+def _init_worker(threads):
+    # each worker runs its own numba thread pool, share the cores between them
+    import numba
+    numba.set_num_threads(threads)
+
+def _run_job(path, start, stop, part_path, params, chunk):
+    tmp_path = part_path[:-len(".npz")] + ".tmp.npz"
+    t = time.perf_counter()
+    pipeline.track_session(path, tmp_path, view=params["view"], start=start, stop=stop, chunk=chunk,
+                           init_vec=params["init_vec"], mode=params["mode"], min_pixels=params["min_pixels"])
+    os.replace(tmp_path, part_path)
+    return os.getpid(), stop - start, time.perf_counter() - t
+
+def _parts_dir(tips_path, params):
+    # parts computed with other parameters are not reused
+    parts_dir = tips_path + ".parts"
+    params_path = os.path.join(parts_dir, "params.json")
+    if os.path.isfile(params_path):
+        with open(params_path) as f:
+            if json.load(f) == params:
+                return parts_dir
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir)
+    with open(params_path, "w") as f:
+        json.dump(params, f)
+    return parts_dir
+
+def _merge_parts(part_paths, tips_path, licks_path, params, max_gap):
+    frames, xs, ys, flags = [], [], [], []
+    for p in part_paths:
+        # read inside the with block so that the handle is closed before the parts are deleted
+        with np.load(p) as part:
+            frames.append(part["frame"])
+            xs.append(part["x"])
+            ys.append(part["y"])
+            flags.append(part["flags"])
+    frames = np.concatenate(frames)
+    tips = np.column_stack([np.concatenate(xs), np.concatenate(ys)])
+    flags = np.concatenate(flags)
+    lick_ids = pipeline.assign_lick_ids(frames, flags, max_gap)
+    pipeline.write_tips(tips_path, frames, tips, lick_ids, flags)
+    tracked = (flags & pipeline.FLAG_SKIPPED) == 0
+    pipeline.write_licks(licks_path, frames[tracked], tips[tracked], np.asarray(params["init_vec"], dtype=np.float32), max_gap)
+
+def run(paths, out_dir=None, view="side", fmt="csv", workers=None, job_frames=65536, chunk=16384,
+        max_gap=1, force=False, verbose=True, **overrides):
+    """
+    Run the pipeline on many archives across a process pool. Sessions are split into jobs of job_frames frames,
+    each worker opens its own archive handle, and each finished job is checkpointed to <tips_path>.parts/, so an
+    interrupted run resumes with the jobs that were not finished. When all jobs of a session are done they are
+    merged into the same tip and lick tables as pipeline.track_session. A failed job is reported and the other
+    sessions are still finished; the failed sessions keep their checkpoints and are raised at the end.
+
+    Parameters:
+    paths (list): The archive paths, see find_archives.
+    out_dir (str): The output directory, defaults to next to each archive.
+    view (str): The preset in pipeline.PRESETS.
+    fmt (str): The output format, "csv" or "npz".
+    workers (int): The number of worker processes, defaults to the number of cores.
+    job_frames (int): The maximum number of frames per job.
+    chunk (int): The number of frames per chunk within a job.
+    max_gap (int): Consecutive tracked frames further apart than this start a new lick.
+    force (bool): Whether to reprocess sessions whose tip table already exists.
+    verbose (bool): Whether to print progress.
+    **overrides: init_vec, mode or min_pixels to use instead of the preset.
+
+    Returns:
+    dict: Frames and seconds processed by each worker pid.
+
+    Raises:
+    RuntimeError: If any job failed, after all other sessions are finished.
+    """
+    workers = workers or os.cpu_count()
+    # the parameters that change the tracked parts, parts tracked with others (or by another version
+    # of the algorithm) are discarded; chunk and max_gap do not change them
+    params = dict(pipeline.PRESETS[view], **overrides, view=view, algorithm=result_cache.algorithm_version())
+    params["init_vec"] = [float(v) for v in params["init_vec"]]
+
+    sessions = {}
+    for path in paths:
+        tips_path, licks_path = pipeline.output_paths(path, out_dir, fmt)
+        if os.path.exists(tips_path) and not force:
+            if verbose:
+                print(f"Skipping {path}, {tips_path} exists")
+            continue
+        sessions[path] = (tips_path, licks_path, _parts_dir(tips_path, params))
+
+    pending = {}
+    remaining = {}
+    for path, start, stop in plan_jobs(list(sessions), job_frames):
+        part_path = os.path.join(sessions[path][2], f"{start:09d}_{stop:09d}.npz")
+        remaining.setdefault(path, []).append(part_path)
+        if not os.path.exists(part_path):
+            pending[(path, start, stop)] = part_path
+
+    def finish(path):
+        tips_path, licks_path, parts_dir = sessions[path]
+        _merge_parts(remaining.pop(path), tips_path, licks_path, params, max_gap)
+        shutil.rmtree(parts_dir)
+        if verbose:
+            print(f"{path} -> {tips_path}")
+
+    for path in [p for p in remaining if all(os.path.exists(q) for q in remaining[p])]:
+        finish(path)
+
+    # forking after the numba kernels are loaded can deadlock their thread pool, so workers are spawned
+    stats = {}
+    failed = {}
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+                                                initargs=(max(1, os.cpu_count() // workers),)) as executor:
+        futures = {executor.submit(_run_job, path, start, stop, part_path, params, chunk): path
+                   for (path, start, stop), part_path in pending.items()}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                pid, n, seconds = future.result()
+            except Exception as e:
+                failed[path] = e
+                print(f"{path}: job failed: {e!r}", file=sys.stderr)
+                continue
+            frames, total = stats.get(pid, (0, 0.0))
+            stats[pid] = (frames + n, total + seconds)
+            if verbose:
+                print(f"worker {pid}: {n} frames of {path} in {seconds:.1f} s ({n / max(seconds, 1e-9):.0f} frames/s)")
+            if path in remaining and all(os.path.exists(q) for q in remaining[path]):
+                finish(path)
+
+    if verbose:
+        for pid, (n, seconds) in sorted(stats.items()):
+            print(f"worker {pid}: {n} frames, {n / max(seconds, 1e-9):.0f} frames/s")
+    if failed:
+        raise RuntimeError(f"{len(failed)} sessions failed: {', '.join(sorted(failed))}")
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Track tongue tips and licks in many .h5 tongue archives across a process pool.")
+    parser.add_argument("patterns", nargs="+", help="Glob patterns, archive paths or manifest files with one archive per line")
+    parser.add_argument("--view", choices=sorted(pipeline.PRESETS), default="side", help="Camera view preset")
+    parser.add_argument("--out-dir", default=None, help="Output directory, defaults to next to each archive")
+    parser.add_argument("--format", choices=["csv", "npz"], default="csv", help="Output format")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes, defaults to the number of cores")
+    parser.add_argument("--job-frames", type=int, default=65536, help="Maximum frames per job")
+    parser.add_argument("--chunk", type=int, default=16384, help="Frames per chunk within a job")
+    parser.add_argument("--max-gap", type=int, default=1, help="Frame gap that starts a new lick")
+    parser.add_argument("--force", action="store_true", help="Reprocess sessions whose outputs exist")
+    parser.add_argument("--mode", choices=["dist", "no_dist"], default=None, help="Override the tip tracking mode of the preset")
+    parser.add_argument("--min-pixels", type=int, default=None, help="Override the pixel count threshold of the preset")
+    parser.add_argument("--init-vec", type=float, nargs=2, default=None, help="Override the initial tongue direction of the preset")
+    args = parser.parse_args()
+
+    overrides = {key: getattr(args, key) for key in ("mode", "min_pixels", "init_vec") if getattr(args, key) is not None}
+    run(find_archives(args.patterns), args.out_dir, args.view, args.format, args.workers, args.job_frames, args.chunk, args.max_gap, args.force,
+        **overrides)
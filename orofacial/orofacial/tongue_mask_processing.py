@@ -19,6 +19,238 @@ class TongueArchive():
         self.widths = self.f.get("widths")
         self.probs = self.f.get("probs")
 
+    def read_masks(self, indices, img_height=256, img_width=256, max_gap=256):
+        """
+        Decode several frames of the archive into a stack of boolean images.
+
+        Sorted indices less than max_gap apart are grouped into runs and each run is read
+        from the file as a single slab, instead of one HDF5 read per frame. The frames
+        between the requested ones are dropped in memory.
+
+        Parameters:
+        indices (array-like): Indices into the archive (not frame numbers).
+        img_height (int): The height of the image.
+        img_width (int): The width of the image.
+        max_gap (int): Indices at least this far apart are read as separate slabs.
+
+        Returns:
+        numpy.ndarray: The images as a boolean numpy array of shape (n, img_height, img_width).
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        masks = np.zeros((len(indices), img_height, img_width), dtype=np.bool_)
+        if len(indices) == 0:
+            return masks
+
+        order = np.argsort(indices, kind="stable")
+        sorted_indices = indices[order]
+        runs = np.split(sorted_indices, np.flatnonzero(np.diff(sorted_indices) >= max_gap) + 1)
+
+        heights, widths = [], []
+        for run in runs:
+            pick = run - run[0]
+            heights.extend(self.heights[run[0]:run[-1] + 1][pick])
+            widths.extend(self.widths[run[0]:run[-1] + 1][pick])
+
+        _scatter_masks(masks, order, heights, widths)
+        return masks
+
+    def iter_masks(self, start=0, stop=None, chunk=1024, img_height=256, img_width=256):
+        """
+        Iterate over the archive in chunks of decoded boolean images.
+
+        Parameters:
+        start (int): The first index to decode.
+        stop (int): One past the last index to decode, defaults to the end of the archive.
+        chunk (int): The number of frames decoded per step.
+        img_height (int): The height of the image.
+        img_width (int): The width of the image.
+
+        Yields:
+        tuple: (frames, masks) where frames is the 1D array of frame numbers and masks is
+        the boolean numpy array of shape (len(frames), img_height, img_width).
+        """
+        if stop is None:
+            stop = len(self.frames)
+        for lo in range(start, stop, chunk):
+            hi = min(lo + chunk, stop)
+            masks = np.zeros((hi - lo, img_height, img_width), dtype=np.bool_)
+            _scatter_masks(masks, np.arange(hi - lo), self.heights[lo:hi], self.widths[lo:hi])
+            yield self.frames[lo:hi], masks
+
+    def read_stack(self, start=0, stop=None, img_height=256, img_width=256):
+        """
+        Read a range of the archive into a MaskStack without densifying any frame.
+
+        Parameters:
+        start (int): The first index to read.
+        stop (int): One past the last index to read, defaults to the end of the archive.
+        img_height (int): The height of the image.
+        img_width (int): The width of the image.
+
+        Returns:
+        MaskStack: The masks of the range in sparse form.
+        """
+        if stop is None:
+            stop = len(self.frames)
+        return MaskStack.from_ragged(self.frames[start:stop], self.heights[start:stop], self.widths[start:stop], img_height, img_width)
+
+class MaskStack():
+    def __init__(self, frames, offsets, heights, widths, img_height=256, img_width=256):
+        """
+        Construct a MaskStack, a compact sparse representation of a sequence of tongue masks.
+        The pixels of mask i are heights[offsets[i]:offsets[i+1]], widths[offsets[i]:offsets[i+1]].
+
+        Parameters:
+        frames (numpy.ndarray): The frame number of each mask, shape (n,).
+        offsets (numpy.ndarray): The offset of each mask into heights and widths, shape (n+1,).
+        heights (numpy.ndarray): The flat row coordinates of all masks.
+        widths (numpy.ndarray): The flat column coordinates of all masks.
+        img_height (int): The height of the image.
+        img_width (int): The width of the image.
+
+        Returns:
+        MaskStack: The constructed MaskStack object.
+        """
+        self.frames = np.asarray(frames)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.heights = np.asarray(heights, dtype=np.int16)
+        self.widths = np.asarray(widths, dtype=np.int16)
+        self.img_height = img_height
+        self.img_width = img_width
+
+    @classmethod
+    def from_ragged(cls, frames, heights, widths, img_height=256, img_width=256):
+        """
+        Construct a MaskStack from ragged sequences of coordinates, e.g. slices of a TongueArchive.
+
+        Parameters:
+        frames (numpy.ndarray): The frame number of each mask, shape (n,).
+        heights (sequence): The row coordinates of each mask.
+        widths (sequence): The column coordinates of each mask.
+        img_height (int): The height of the image.
+        img_width (int): The width of the image.
+
+        Returns:
+        MaskStack: The constructed MaskStack object.
+        """
+        lengths = np.fromiter(map(len, heights), dtype=np.int64, count=len(heights))
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        if offsets[-1] == 0:
+            return cls(frames, offsets, [], [], img_height, img_width)
+        return cls(frames, offsets, np.concatenate(heights), np.concatenate(widths), img_height, img_width)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def count_nonzero(self):
+        """
+        Number of pixels in each mask, computed without densifying.
+
+        Returns:
+        numpy.ndarray: The pixel count of each mask, shape (n,).
+        """
+        return np.diff(self.offsets)
+
+    def bounding_boxes(self):
+        """
+        Bounding box of each mask, computed without densifying.
+
+        Returns:
+        numpy.ndarray: Array of shape (n, 4) of (top, left, bottom, right) with bottom and right
+        exclusive, so that img[top:bottom, left:right] is the cropped mask. Empty masks get (0, 0, 0, 0).
+        """
+        boxes = np.zeros((len(self), 4), dtype=np.int16)
+        nonempty = np.flatnonzero(self.count_nonzero() > 0)
+        if len(nonempty) == 0:
+            return boxes
+        starts = self.offsets[nonempty]
+        boxes[nonempty, 0] = np.minimum.reduceat(self.heights, starts)
+        boxes[nonempty, 1] = np.minimum.reduceat(self.widths, starts)
+        boxes[nonempty, 2] = np.maximum.reduceat(self.heights, starts) + 1
+        boxes[nonempty, 3] = np.maximum.reduceat(self.widths, starts) + 1
+        return boxes
+
+    def subset(self, indices):
+        """
+        Select masks of the stack, e.g. with a boolean filter on count_nonzero().
+
+        Parameters:
+        indices (array-like): Integer indices or boolean mask of the masks to keep.
+
+        Returns:
+        MaskStack: A new MaskStack with only the selected masks.
+        """
+        indices = np.arange(len(self))[indices]
+        lengths = np.diff(self.offsets)[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        pos = np.arange(offsets[-1]) + np.repeat(self.offsets[indices] - offsets[:-1], lengths)
+        return MaskStack(self.frames[indices], offsets, self.heights[pos], self.widths[pos], self.img_height, self.img_width)
+
+    def densify(self, i):
+        """
+        Plot a single mask of the stack as a boolean image.
+
+        Parameters:
+        i (int): The index of the mask in the stack.
+
+        Returns:
+        numpy.ndarray: The image as a boolean numpy array.
+        """
+        img = np.zeros((self.img_height, self.img_width), dtype=np.bool_)
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        img[self.heights[lo:hi], self.widths[lo:hi]] = 1
+        return img
+
+    def densify_roi(self, i):
+        """
+        Plot a single mask of the stack cropped to its bounding box with a one pixel margin, see _plot_roi.
+
+        Parameters:
+        i (int): The index of the mask in the stack.
+
+        Returns:
+        tuple: (img, (top, left)) where img is the cropped boolean image and (top, left)
+        its offset in the full image.
+        """
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return _plot_roi(self.heights[lo:hi], self.widths[lo:hi], self.img_height, self.img_width)
+
+    def densify_batch(self, indices=None):
+        """
+        Plot several masks of the stack as a stack of boolean images.
+
+        Parameters:
+        indices (array-like): The indices of the masks to plot, defaults to all masks.
+
+        Returns:
+        numpy.ndarray: The images as a boolean numpy array of shape (n, img_height, img_width).
+        """
+        stack = self if indices is None else self.subset(indices)
+        masks = np.zeros((len(stack), self.img_height, self.img_width), dtype=np.bool_)
+        rows = np.repeat(np.arange(len(stack)), stack.count_nonzero())
+        masks[rows, stack.heights, stack.widths] = 1
+        return masks
+
+def _scatter_masks(masks, rows, heights, widths):
+    """
+    Set the pixels of ragged (heights, widths) arrays into a stack of images in one step.
+
+    Parameters:
+    masks (numpy.ndarray): The boolean image stack of shape (n, img_height, img_width).
+    rows (numpy.ndarray): The image in masks that each ragged entry belongs to.
+    heights (sequence): The row coordinates of each entry.
+    widths (sequence): The column coordinates of each entry.
+
+    Returns:
+    None
+    """
+    lengths = np.fromiter(map(len, heights), dtype=np.int64, count=len(heights))
+    if lengths.sum() == 0:
+        return
+    masks[np.repeat(rows, lengths), np.concatenate(heights), np.concatenate(widths)] = 1
+
 def plot_frame(archive, frame_no, img_height, img_width):
     """
     Plot a frame from the TongueArchive object as a single channel image
@@ -53,6 +285,46 @@ def plot_frame_bool(archive, frame_no, img_height, img_width):
     img[archive.heights[frame_no], archive.widths[frame_no]] = 1
     return img
 
+def plot_frame_bool_roi(archive, frame_no, img_height=256, img_width=256):
+    """
+    Plot a frame from the TongueArchive object as a boolean image cropped to the bounding box of the mask
+    with a one pixel margin, see _plot_roi.
+
+    Parameters:
+    archive (TongueArchive): The TongueArchive object.
+    frame_no (int): The frame number.
+    img_height (int): The height of the image, the margin is clipped to it.
+    img_width (int): The width of the image, the margin is clipped to it.
+
+    Returns:
+    tuple: (img, (top, left)) where img is the cropped boolean image and (top, left)
+    its offset in the full image. Add (left, top) to points found in img to get image coordinates.
+    """
+    return _plot_roi(archive.heights[frame_no], archive.widths[frame_no], img_height, img_width)
+
+def _plot_roi(heights, widths, img_height, img_width):
+    """
+    Plot pixel coordinates as a boolean image cropped to their bounding box with a one pixel margin,
+    clipped to the image. The tip finders of tongue_tip_track_2D count pixels outside the image as foreground,
+    so without the margin pixels on the edge of the box would count as boundary only in the full image.
+
+    Parameters:
+    heights (numpy.ndarray): The row coordinates.
+    widths (numpy.ndarray): The column coordinates.
+    img_height (int): The height of the image.
+    img_width (int): The width of the image.
+
+    Returns:
+    tuple: (img, (top, left)), an empty image at (0, 0) if there are no pixels.
+    """
+    if len(heights) == 0:
+        return np.zeros((0, 0), dtype=np.bool_), (0, 0)
+    top, left = max(int(heights.min()) - 1, 0), max(int(widths.min()) - 1, 0)
+    bottom, right = min(int(heights.max()) + 2, img_height), min(int(widths.max()) + 2, img_width)
+    img = np.zeros((bottom - top, right - left), dtype=np.bool_)
+    img[heights - top, widths - left] = 1
+    return img, (top, left)
+
 def keep_largest_cc(img):
     """
     Keep the largest connected component in a binary image
@@ -64,12 +336,63 @@ def keep_largest_cc(img):
     numpy.ndarray: The image with only the largest connected component.
     """
     nb_components, labels, stats, centroids = cv.connectedComponentsWithStats(img, connectivity=4)
-    sizes = sorted([(s, i) for i, s in enumerate(stats[:, -1])], reverse=True)
+    if nb_components <= 1:
+        return img
 
-    img[np.where(np.logical_and(labels != sizes[0][1], labels != sizes[1][1]))] = [0]
+    # label 0 is the background, ties go to the later component
+    areas = stats[1:, cv.CC_STAT_AREA]
+    best = nb_components - 1 - np.argmax(areas[::-1])
 
+    np.multiply(img, (labels == best).reshape(img.shape), out=img)
     return img
 
+def keep_largest_cc_batch(masks, boxes=None, crop=True):
+    """
+    Keep the largest connected component in each image of a stack, in place.
+
+    Parameters:
+    masks (numpy.ndarray): The boolean or uint8 image stack of shape (n, img_height, img_width).
+    boxes (numpy.ndarray): Optional (n, 4) bounding boxes as from MaskStack.bounding_boxes(), computed if not given.
+    crop (bool): Label only the bounding box of each image instead of the whole image.
+
+    Returns:
+    numpy.ndarray: The image stack with only the largest connected component of each image.
+    """
+    imgs = masks.view(np.uint8) if masks.dtype == np.bool_ else masks
+    if not crop:
+        for img in imgs:
+            keep_largest_cc(img)
+        return masks
+
+    if boxes is None:
+        boxes = _bounding_boxes(masks)
+    for img, (top, left, bottom, right) in zip(imgs, boxes):
+        if bottom > top:
+            keep_largest_cc(img[top:bottom, left:right])
+    return masks
+
+def _bounding_boxes(masks):
+    """
+    Bounding box of each image of a dense stack, in the format of MaskStack.bounding_boxes().
+
+    Parameters:
+    masks (numpy.ndarray): The image stack of shape (n, img_height, img_width).
+
+    Returns:
+    numpy.ndarray: Array of shape (n, 4) of (top, left, bottom, right), (0, 0, 0, 0) for empty images.
+    """
+    rows = masks.any(axis=2)
+    cols = masks.any(axis=1)
+    nonempty = rows.any(axis=1)
+    boxes = np.stack([
+        np.argmax(rows, axis=1),
+        np.argmax(cols, axis=1),
+        rows.shape[1] - np.argmax(rows[:, ::-1], axis=1),
+        cols.shape[1] - np.argmax(cols[:, ::-1], axis=1),
+    ], axis=1)
+    boxes[~nonempty] = 0
+    return boxes
+
 if __name__ == "__main__":
     # Sample usage
     arch = TongueArchive("./data/phox2b38_20240307_1_tongue.h5")
@@ -0,0 +1,40 @@
+import argparse
+import time
+
+import cv2 as cv
+import numpy as np
+
+from grabcut_app import grabcut_multires
+
+parser = argparse.ArgumentParser(description='Compare full resolution and coarse-to-fine GrabCut.')
+parser.add_argument('--in', dest='in_path', default='cpp/scene02963.png', help='Input image path')
+parser.add_argument('--upscale', type=float, default=3, help='Upscaling factor, to emulate high resolution frames')
+parser.add_argument('--iters', type=int, default=5, help='Number of iterations')
+parser.add_argument('--rect', type=int, nargs=4, default=None, metavar=('X', 'Y', 'W', 'H'), help='Rectangle in input image pixels, defaults to the centre half')
+args = parser.parse_args()
+
+img = cv.imread(args.in_path)
+img = cv.resize(img, None, fx=args.upscale, fy=args.upscale, interpolation=cv.INTER_CUBIC)
+h, w = img.shape[:2]
+rect = (w//4, h//4, w//2, h//2) if args.rect is None else tuple(int(round(v * args.upscale)) for v in args.rect)
+
+def segment(step):
+	# GrabCut initialises its models with k-means on the global OpenCV RNG
+	cv.setRNGSeed(0)
+	mask = np.zeros((h, w), np.uint8)
+	bgdmodel = np.zeros((1, 65), np.float64)
+	fgdmodel = np.zeros((1, 65), np.float64)
+	times = []
+	for i in range(args.iters):
+		start = time.perf_counter()
+		step(mask, bgdmodel, fgdmodel, cv.GC_INIT_WITH_RECT if i == 0 else cv.GC_EVAL)
+		times.append(time.perf_counter() - start)
+	return (mask & 1).astype(bool), times
+
+ref, ref_times = segment(lambda m, b, f, mode: cv.grabCut(img, m, rect, b, f, 1, mode))
+print(f"{w}x{h}, rect {rect}, {args.iters} iterations")
+print(f"full resolution: {np.mean(ref_times):.2f} s/iteration, {100*ref.mean():.1f}% foreground")
+for scale in (0.5, 0.25):
+	fg, times = segment(lambda m, b, f, mode: grabcut_multires(img, m, rect, b, f, mode, scale))
+	iou = (fg & ref).sum() / (fg | ref).sum()
+	print(f"scale {scale}: {np.mean(times):.2f} s/iteration ({np.mean(ref_times)/np.mean(times):.1f}x), {100*fg.mean():.1f}% foreground, IoU with full resolution {iou:.3f}")
@@ -1,5 +1,8 @@
 #include <iostream>
 #include <functional>
+#include <algorithm>
+#include <cmath>
+#include <thread>
 
 #include <opencv2/imgcodecs.hpp>
 #include <opencv2/highgui.hpp>
@@ -30,15 +33,27 @@ void GrabCutTool::runHighgui(){
 
     cv::setMouseCallback("Editor", _mouseHandlerWrapper, this);
 
+    bool running = false;
     while (true){
+        if (pollGrabcut()){
+            std::cout << "GrabCut iteration done\n";
+        }
+        if (grabcutRunning()){
+            cv::setWindowTitle("Mask Preview", "Mask Preview - segmenting " + std::to_string(grabcutElapsed()).substr(0, 4) + " s");
+            running = true;
+        } else if (running){
+            cv::setWindowTitle("Mask Preview", "Mask Preview");
+            running = false;
+        }
         cv::imshow("Editor", getImgDisp());
         cv::imshow("Mask Preview", getMaskDisp());
         switch (cv::waitKey(1)){
             case 'g':
-                grabcutIter();
-                std::cout << "GrabCut iteration\n";
+                grabcutIterAsync();
+                std::cout << "GrabCut iteration started\n";
                 break;
             case 'q':
+                cancelGrabcut();
                 cv::destroyAllWindows();
                 std::cout << "Quit\n";
                 return;
@@ -66,6 +81,10 @@ void GrabCutTool::runHighgui(){
                 setColor(cv::GC_PR_FGD);
                 std::cout << "Drawing probable foreground\n";
                 break;
+            case 'm':
+                setMultiResScale(_multires_scale < 1.0 ? 1.0 : 0.5);
+                std::cout << "Multi-resolution scale: " << _multires_scale << "\n";
+                break;
         }
     }
 
@@ -114,6 +133,20 @@ void GrabCutTool::mouseDown(int x, int y){
     if (_rect_stage){
         _rect = cv::Rect(x, y, 0, 0);
     } else {
+        if (grabcutRunning()){
+            // the running job segments a stale mask, run it again once the stroke is done
+            cancelGrabcut();
+            _resubmit = true;
+            if (!_first_iter){
+                // the first job starts from the rect, carry it into the mask so that the
+                // stroke is not overwritten by cv::GC_INIT_WITH_RECT when the job is restarted
+                _bg_model = cv::Mat::zeros(1, 65, CV_64FC1);
+                _fg_model = cv::Mat::zeros(1, 65, CV_64FC1);
+                _mask = cv::Mat(_img.size(), CV_8UC1, cv::Scalar(cv::GC_BGD));
+                _mask(_rect & cv::Rect(0, 0, _img.cols, _img.rows)).setTo(cv::GC_PR_FGD);
+                _first_iter = true;
+            }
+        }
         _mouse_prev = cv::Point(x, y);
         cv::circle(_mask, _mouse_prev, _brush_thickness, _color, -1);
     }
@@ -148,6 +181,9 @@ void GrabCutTool::mouseUp(int x, int y){
     _drawing = false;
     if (_rect_stage){
         _rect_stage = false;
+    } else if (_resubmit){
+        _resubmit = false;
+        grabcutIterAsync();
     }
 }
 
@@ -195,11 +231,199 @@ void GrabCutTool::grabcutIter(){
         _bg_model = cv::Mat::zeros(1, 65, CV_64FC1);
         _fg_model = cv::Mat::zeros(1, 65, CV_64FC1);
         _mask = cv::Mat::zeros(_img.size(), CV_8UC1);
-        cv::grabCut(_img, _mask, _rect, _bg_model, _fg_model, 1, cv::GC_INIT_WITH_RECT);
+        _grabcut(_img, _mask, _rect, _bg_model, _fg_model, cv::GC_INIT_WITH_RECT, _multires_scale, _multires_band);
         _first_iter = true;
     } else {
-        cv::grabCut(_img, _mask, _rect, _bg_model, _fg_model, 1, cv::GC_INIT_WITH_MASK);
+        _grabcut(_img, _mask, _rect, _bg_model, _fg_model, cv::GC_INIT_WITH_MASK, _multires_scale, _multires_band);
+    }
+}
+
+/**
+ * @brief Start a GrabCut iteration on a worker thread, on a snapshot of the mask and models.
+ * A job already running works on a stale mask and is cancelled. Use pollGrabcut to publish the result.
+ */
+void GrabCutTool::grabcutIterAsync(){
+    if (_rect_stage){
+        std::cout << "Error: Please select a region of interest\n";
+        return;
+    }
+    cancelGrabcut();
+
+    auto job = std::make_shared<GrabCutJob>();
+    job->img = _img;
+    job->rect = _rect;
+    job->scale = _multires_scale;
+    job->band = _multires_band;
+    job->start = std::chrono::steady_clock::now();
+    if (!_first_iter){
+        job->mask = cv::Mat::zeros(_img.size(), CV_8UC1);
+        job->bg_model = cv::Mat::zeros(1, 65, CV_64FC1);
+        job->fg_model = cv::Mat::zeros(1, 65, CV_64FC1);
+        job->mode = cv::GC_INIT_WITH_RECT;
+    } else {
+        job->mask = _mask.clone();
+        job->bg_model = _bg_model.clone();
+        job->fg_model = _fg_model.clone();
+        job->mode = cv::GC_INIT_WITH_MASK;
+    }
+
+    // the thread only touches the job, so a cancelled job can finish after it is dropped
+    std::thread([job](){
+        _grabcut(job->img, job->mask, job->rect, job->bg_model, job->fg_model, job->mode, job->scale, job->band);
+        job->done = true;
+    }).detach();
+    _job = job;
+}
+
+/**
+ * @brief Publish the result of a finished GrabCut job
+ * 
+ * @return true if the mask was updated
+ */
+bool GrabCutTool::pollGrabcut(){
+    if (!_job || !_job->done){
+        return false;
+    }
+    _mask = _job->mask;
+    _bg_model = _job->bg_model;
+    _fg_model = _job->fg_model;
+    _first_iter = true;
+    _job.reset();
+    return true;
+}
+
+/**
+ * @brief Drop the running GrabCut job, its result is discarded when it finishes
+ */
+void GrabCutTool::cancelGrabcut(){
+    _job.reset();
+}
+
+/**
+ * @brief Whether a GrabCut job is running
+ */
+bool GrabCutTool::grabcutRunning(){
+    return _job && !_job->done;
+}
+
+/**
+ * @brief Seconds since the running GrabCut job started
+ */
+double GrabCutTool::grabcutElapsed(){
+    if (!_job){
+        return 0;
+    }
+    return std::chrono::duration<double>(std::chrono::steady_clock::now() - _job->start).count();
+}
+
+/**
+ * @brief Set the scale of the coarse GrabCut pass, 1 to run at full resolution only
+ * 
+ * @param scale Downscaling factor, e.g. 0.5 for high resolution images
+ */
+void GrabCutTool::setMultiResScale(double scale){
+    _multires_scale = std::min(1.0, std::max(scale, 0.01));
+}
+
+/**
+ * @brief Run a GrabCut iteration, coarse-to-fine if a multi-resolution scale is set.
+ * The graph cut runs on a downscaled copy of the image, and only a narrow band around the
+ * upsampled boundary is re-segmented at full resolution, in tiles, with the colour models
+ * of the coarse pass frozen and everything outside the band fixed.
+ * Static, so that a worker thread can run it on a snapshot of the state.
+ * 
+ * @param _img Image
+ * @param _mask GrabCut mask, updated in place
+ * @param _rect Region of interest for cv::GC_INIT_WITH_RECT
+ * @param _bg_model Background model, updated in place
+ * @param _fg_model Foreground model, updated in place
+ * @param mode cv::GC_INIT_WITH_RECT or cv::GC_INIT_WITH_MASK
+ * @param _multires_scale Scale of the coarse pass, 1 to run at full resolution only
+ * @param _multires_band Width of the band refined at full resolution
+ */
+void GrabCutTool::_grabcut(const cv::Mat& _img, cv::Mat& _mask, cv::Rect _rect, cv::Mat& _bg_model, cv::Mat& _fg_model,
+                           int mode, double _multires_scale, int _multires_band){
+    // the smoothness term is per edge, so keep the coarse image large enough for the subject to survive
+    double scale = std::max(_multires_scale, 480.0 / std::min(_img.rows, _img.cols));
+    if (scale >= 1.0){
+        cv::grabCut(_img, _mask, _rect, _bg_model, _fg_model, 1, mode);
+        return;
+    }
+    // an iteration that keeps less than a tenth of the prior foreground is rerun at full resolution
+    const double min_keep = 0.1;
+    double prior = mode == cv::GC_INIT_WITH_RECT ? (double)_rect.area() : (double)cv::countNonZero(_mask & 1);
+    cv::Mat bg_model = _bg_model.clone(), fg_model = _fg_model.clone();
+    auto fullResolution = [&](){
+        bg_model.copyTo(_bg_model);
+        fg_model.copyTo(_fg_model);
+        cv::grabCut(_img, _mask, _rect, _bg_model, _fg_model, 1, mode);
+    };
+
+    cv::Rect img_rect(0, 0, _img.cols, _img.rows);
+    cv::Size size(std::max(1, (int)std::lround(_img.cols * scale)), std::max(1, (int)std::lround(_img.rows * scale)));
+    cv::Mat small_img, small_mask;
+    cv::resize(_img, small_img, size, 0, 0, cv::INTER_AREA);
+    cv::Rect small_rect = _rect;
+    if (mode == cv::GC_INIT_WITH_RECT){
+        small_mask = cv::Mat::zeros(size, CV_8UC1);
+        small_rect = cv::Rect((int)std::lround(_rect.x * scale), (int)std::lround(_rect.y * scale),
+                              (int)std::lround(_rect.width * scale), (int)std::lround(_rect.height * scale));
+        _mask.setTo(cv::GC_BGD);
+        _mask(_rect & img_rect).setTo(cv::GC_PR_BGD);
+    } else {
+        // majority vote of the foreground bit, then the sure labels that cover most of a coarse pixel
+        cv::Mat small_fg;
+        cv::resize((_mask & 1) * 255, small_fg, size, 0, 0, cv::INTER_AREA);
+        small_mask = cv::Mat(size, CV_8UC1, cv::Scalar(cv::GC_PR_BGD));
+        small_mask.setTo(cv::GC_PR_FGD, small_fg > 127);
+        for (int label : {cv::GC_BGD, cv::GC_FGD}){
+            cv::Mat small_label;
+            cv::resize(_mask == label, small_label, size, 0, 0, cv::INTER_AREA);
+            small_mask.setTo(label, small_label > 127);
+        }
+    }
+    cv::grabCut(small_img, small_mask, small_rect, _bg_model, _fg_model, 1, mode);
+    if (cv::countNonZero(small_mask & 1) < min_keep * prior * scale * scale){
+        fullResolution();
+        return;
+    }
+
+    // upsample, keeping the sure labels of the full resolution mask
+    cv::Mat sure = (_mask == cv::GC_BGD) | (_mask == cv::GC_FGD);
+    cv::Mat up;
+    cv::resize(small_mask, up, _img.size(), 0, 0, cv::INTER_NEAREST);
+    cv::Mat labels = (up & 1) | cv::Scalar(cv::GC_PR_BGD);
+    _mask.copyTo(labels, sure);
+
+    cv::Mat fg = labels & 1;
+    cv::Mat kernel = cv::getStructuringElement(cv::MORPH_ELLIPSE, cv::Size(2*_multires_band + 1, 2*_multires_band + 1));
+    cv::Mat dilated, eroded;
+    cv::dilate(fg, dilated, kernel);
+    cv::erode(fg, eroded, kernel);
+    cv::Mat ring = (dilated != eroded) & ~sure;
+    cv::Mat fixed(labels.size(), CV_8UC1, cv::Scalar(cv::GC_BGD));
+    fixed.setTo(cv::GC_FGD, fg);
+    labels.copyTo(fixed, ring);
+
+    const int tile = 64;
+    for (int y0 = 0; y0 < _img.rows; y0 += tile){
+        for (int x0 = 0; x0 < _img.cols; x0 += tile){
+            cv::Rect core = cv::Rect(x0, y0, tile, tile) & img_rect;
+            if (cv::countNonZero(ring(core)) == 0){
+                continue;
+            }
+            // a margin of the band width keeps the pairwise terms across tile borders
+            cv::Rect outer = cv::Rect(x0 - _multires_band, y0 - _multires_band, tile + 2*_multires_band, tile + 2*_multires_band) & img_rect;
+            cv::Mat t = fixed(outer).clone();
+            cv::grabCut(_img(outer), t, _rect, _bg_model, _fg_model, 1, cv::GC_EVAL_FREEZE_MODEL);
+            t(core - outer.tl()).copyTo(labels(core), ring(core));
+        }
+    }
+    if (cv::countNonZero(labels & 1) < min_keep * prior){
+        fullResolution();
+        return;
     }
+    labels.copyTo(_mask);
 }
 
 /**
@@ -1,9 +1,25 @@
 #ifndef GRABCUTTOOL_HPP
 #define GRABCUTTOOL_HPP
 
+#include <atomic>
+#include <chrono>
+#include <memory>
+
 #include <opencv2/imgcodecs.hpp>
 #include <opencv2/imgproc.hpp>
 
+// A GrabCut iteration on a snapshot of the mask and models, run on a worker thread
+struct GrabCutJob
+{
+    cv::Mat img, mask, bg_model, fg_model;
+    cv::Rect rect;
+    int mode;
+    double scale;
+    int band;
+    std::atomic<bool> done{false};
+    std::chrono::steady_clock::time_point start;
+};
+
 class GrabCutTool
 {
 public:
@@ -28,6 +44,14 @@ public:
 
     // GrabCut specific
     void grabcutIter();
+    void setMultiResScale(double scale);
+
+    // GrabCut on a worker thread
+    void grabcutIterAsync();
+    bool pollGrabcut();
+    void cancelGrabcut();
+    bool grabcutRunning();
+    double grabcutElapsed();
 
 private:
     cv::Mat _img;
@@ -44,7 +68,13 @@ private:
     // grabCut specific
     cv::Mat _mask;
     cv::Mat _bg_model, _fg_model;
+    double _multires_scale = 1.0;
+    int _multires_band = 4;
+    std::shared_ptr<GrabCutJob> _job;
+    bool _resubmit = false;
 
+    static void _grabcut(const cv::Mat& _img, cv::Mat& _mask, cv::Rect _rect, cv::Mat& _bg_model, cv::Mat& _fg_model,
+                         int mode, double _multires_scale, int _multires_band);
     void _brushOutline(cv::Mat& img);
 
     // Testing with OpenCV highlevel GUI
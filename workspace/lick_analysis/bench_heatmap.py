@@ -0,0 +1,37 @@
+import time
+
+import numpy as np
+
+import lick_analysis
+
+# the lick heatmap from the trajectory notebooks
+def interpolate_and_update_heatmap(start, end, heatmap, resolution):
+    num_points = max(abs(end - start)) * resolution
+    for t in np.linspace(0, 1, int(num_points)):
+        interp_point = start + t * (end - start)
+        x_idx, y_idx = interp_point
+        x_idx = np.round(np.clip(x_idx*640/256, 0, 638)).astype(int)
+        y_idx = np.round(np.clip(y_idx*480/256, 0, 478)).astype(int)
+        heatmap[y_idx, x_idx] += 1
+
+rng = np.random.default_rng(0)
+n_licks = 300
+paths = 128 + np.cumsum(rng.normal(scale=0.8, size=(n_licks, 100, 2)), axis=1)
+
+start = time.perf_counter()
+heatmap_loop = np.zeros((480, 640))
+for p in paths:
+    prev = p[0]
+    for curr in p[1:]:
+        interpolate_and_update_heatmap(np.array(prev)[::-1], np.array(curr)[::-1], heatmap_loop, resolution=20)
+        prev = curr
+loop_time = time.perf_counter() - start
+
+start = time.perf_counter()
+# the notebook heatmap is indexed [x, y] and shown transposed
+heatmap = lick_analysis.rasterize_paths(paths, shape=(640, 480), scale=(480/256, 640/256))
+vec_time = time.perf_counter() - start
+
+print(f"{n_licks} licks: loop {loop_time:.2f} s, rasterize_paths {vec_time*1000:.1f} ms ({loop_time/vec_time:.0f}x)")
+# the two clip differently at the border, see rasterize_paths
+print(f"identical inside the border: {np.array_equal(heatmap_loop.T[:-2, :-2], heatmap[:-2, :-2])}")
@@ -0,0 +1,135 @@
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+def draw_overlay(mask, tip, out, scale, tip_color=(0, 0, 255), tip_radius=3):
+    """
+    Draw a tongue mask and its tip into a frame buffer.
+
+    Parameters:
+    mask (numpy.ndarray): The boolean mask image.
+    tip (numpy.ndarray): The tip coordinates (x, y) in mask coordinates, skipped if NaN.
+    out (numpy.ndarray): The uint8 BGR frame buffer of shape (height, width, 3) to draw into.
+    scale (tuple): The (x, y) factors from mask coordinates to frame pixels.
+    tip_color (tuple): The BGR color of the tip.
+    tip_radius (int): The radius of the tip in frame pixels.
+
+    Returns:
+    None
+    """
+    gray = cv.resize(mask.view(np.uint8) * np.uint8(255), (out.shape[1], out.shape[0]), interpolation=cv.INTER_NEAREST)
+    cv.cvtColor(gray, cv.COLOR_GRAY2BGR, dst=out)
+    if not np.isnan(tip).any():
+        # mask pixel x covers frame pixels [x * s, (x + 1) * s), so its centre is at (x + 0.5) * s - 0.5
+        center = (int(round((tip[0] + 0.5) * scale[0] - 0.5)), int(round((tip[1] + 0.5) * scale[1] - 0.5)))
+        cv.circle(out, center, tip_radius, tip_color, -1, lineType=cv.LINE_AA)
+
+def render_overlay_video(out_path, masks, tips, start=0, stop=None, fps=30, size=(640, 480), backend=None, threads=4, chunk=256):
+    """
+    Render a QC video of tongue masks with their tracked tips. Frames are drawn with OpenCV into a
+    reused buffer by worker threads and written directly to the encoder, without intermediate images.
+
+    Parameters:
+    out_path (str): The path of the output video, e.g. "qc.mp4".
+    masks (MaskStack or numpy.ndarray): The masks, as a MaskStack or a boolean array of shape (n, height, width).
+    tips (numpy.ndarray): The tip coordinates of shape (n, 2) aligned with masks, NaN rows are drawn without a tip.
+    start (int): The first index to render.
+    stop (int): One past the last index to render, defaults to the end.
+    fps (float): The frame rate of the video.
+    size (tuple): The (width, height) of the video.
+    backend (str): "ffmpeg" pipes raw frames to an ffmpeg process, "opencv" uses cv.VideoWriter.
+    Defaults to "ffmpeg" if it is on the PATH, otherwise "opencv".
+    threads (int): The number of drawing threads.
+    chunk (int): The number of frames drawn per step.
+
+    Returns:
+    None
+    """
+    if stop is None:
+        stop = len(masks)
+    if backend is None:
+        backend = "ffmpeg" if shutil.which("ffmpeg") else "opencv"
+    if backend not in ("ffmpeg", "opencv"):
+        raise ValueError(f"Unknown backend {backend!r}, expected 'ffmpeg' or 'opencv'")
+
+    width, height = size
+    if hasattr(masks, "densify_batch"):
+        img_height, img_width = masks.img_height, masks.img_width
+    else:
+        img_height, img_width = masks.shape[1:]
+    scale = (width / img_width, height / img_height)
+    tips = np.asarray(tips, dtype=np.float32)
+
+    if backend == "ffmpeg":
+        proc = subprocess.Popen([
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+            "-pix_fmt", "yuv420p", out_path,
+        ], stdin=subprocess.PIPE)
+        write = proc.stdin.write
+    else:
+        writer = cv.VideoWriter(out_path, cv.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+        if not writer.isOpened():
+            raise RuntimeError(f"Could not open {out_path} for writing")
+        write = None
+
+    buf = np.zeros((chunk, height, width, 3), dtype=np.uint8)
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for lo in range(start, stop, chunk):
+                hi = min(lo + chunk, stop)
+                if hasattr(masks, "densify_batch"):
+                    batch = masks.densify_batch(np.arange(lo, hi))
+                else:
+                    batch = np.asarray(masks[lo:hi], dtype=np.bool_)
+                list(pool.map(lambda i: draw_overlay(batch[i], tips[lo + i], buf[i], scale), range(hi - lo)))
+                if write is not None:
+                    write(buf[:hi - lo].tobytes())
+                else:
+                    for frame in buf[:hi - lo]:
+                        writer.write(frame)
+    except BaseException:
+        # keep the original error, e.g. a BrokenPipeError after ffmpeg died, ffmpeg reports its own on stderr
+        if backend == "ffmpeg":
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+            proc.wait()
+        else:
+            writer.release()
+        raise
+    if backend == "ffmpeg":
+        proc.stdin.close()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {proc.returncode}")
+    else:
+        writer.release()
+
+if __name__ == "__main__":
+    # Command line usage, run as python -m orofacial.qc_video
+    import argparse
+    from . import pipeline, tongue_mask_processing, tongue_tip_track_2D
+    parser = argparse.ArgumentParser(prog="orofacial.qc_video", description="Render a QC video of tracked tongue tips.")
+    parser.add_argument("--in", dest="input", required=True, help="Input .h5 tongue archive")
+    parser.add_argument("--out", dest="output", required=True, help="Output video path")
+    parser.add_argument("--start", type=int, default=0, help="First frame index to render")
+    parser.add_argument("--stop", type=int, default=None, help="One past the last frame index to render")
+    parser.add_argument("--view", choices=sorted(pipeline.PRESETS), default="side", help="Camera view preset")
+    parser.add_argument("--mode", choices=["dist", "no_dist"], default=None, help="Override the tip tracking mode of the preset")
+    parser.add_argument("--min-pixels", type=int, default=None, help="Override the pixel count threshold of the preset")
+    parser.add_argument("--init-vec", type=float, nargs=2, default=None, help="Override the initial tongue direction of the preset")
+    parser.add_argument("--fps", type=float, default=30, help="Frame rate of the video")
+    args = parser.parse_args()
+
+    params = dict(pipeline.PRESETS[args.view])
+    for key in ("mode", "min_pixels", "init_vec"):
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+    archive = tongue_mask_processing.TongueArchive(args.input)
+    stack = archive.read_stack(args.start, args.stop)
+    tips = tongue_tip_track_2D.track_archive(stack, np.asarray(params["init_vec"], dtype=np.float32), params["mode"], params["min_pixels"])
+    render_overlay_video(args.output, stack, tips, fps=args.fps)
@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+from types import SimpleNamespace
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tongue_mask_processing"))
+import tongue_mask_processing
+import tongue_tip_track_2D
+
+parser = argparse.ArgumentParser(description="Check that track_archive finds the same tips as the full image pipeline.")
+parser.add_argument("--in", dest="in_path", default=None, help="Tongue archive (.h5), defaults to synthetic masks")
+parser.add_argument("--frames", type=int, default=400, help="Number of frames to check")
+parser.add_argument("--tol", type=float, default=1e-3, help="Maximum tip distance in pixels")
+args = parser.parse_args()
+
+h, w = 256, 256
+if args.in_path is None:
+    # tongue-like ellipses with specks, some of them cut by the image border
+    rng = np.random.default_rng(0)
+    heights, widths = [], []
+    for i in range(args.frames):
+        img = np.zeros((h, w), np.uint8)
+        center = (int(rng.integers(-20, w + 20)), int(rng.integers(-20, h + 20)))
+        axes = (int(rng.integers(5, 60)), int(rng.integers(3, 30)))
+        cv.ellipse(img, center, axes, float(rng.uniform(0, 180)), 0, 360, 1, -1)
+        img[rng.integers(0, h, 5), rng.integers(0, w, 5)] = 1
+        ys, xs = np.nonzero(img)
+        heights.append(ys.astype(np.int16))
+        widths.append(xs.astype(np.int16))
+    archive = SimpleNamespace(heights=heights, widths=widths)
+    offsets = np.zeros(args.frames + 1, dtype=np.int64)
+    np.cumsum([len(y) for y in heights], out=offsets[1:])
+    stack = tongue_mask_processing.MaskStack(np.arange(args.frames), offsets, np.concatenate(heights), np.concatenate(widths), h, w)
+else:
+    archive = tongue_mask_processing.TongueArchive(args.in_path)
+    stack = archive.read_stack(0, min(args.frames, len(archive.frames)), h, w)
+
+failed = False
+for mode, init_vec, min_pixels in (("dist", [-1, 1], 15), ("no_dist", [-1, 0], 60)):
+    init_vec = np.asarray(init_vec, dtype=np.float32)
+    tips = tongue_tip_track_2D.track_archive(stack, init_vec, mode, min_pixels)
+    ref = np.full_like(tips, np.nan)
+    for i in range(len(stack)):
+        img = tongue_mask_processing.plot_frame_bool(archive, i, h, w)
+        if img.sum() <= min_pixels:
+            continue
+        img = tongue_mask_processing.keep_largest_cc(img.astype(np.uint8)).astype(bool)
+        if mode == "dist":
+            ref[i] = tongue_tip_track_2D.find_tongue_tip(img, init_vec)
+        else:
+            ref[i] = tongue_tip_track_2D.find_tongue_tip_no_dist(img, init_vec)
+    dist = np.where(np.isnan(ref[:, 0]) & np.isnan(tips[:, 0]), 0, np.linalg.norm(tips - ref, axis=1))
+    n_diff = np.count_nonzero(~(dist <= args.tol))
+    print(f"{mode}: {n_diff} of {len(stack)} frames differ from the full image pipeline, max distance {np.nanmax(dist):.3f} px")
+    failed |= n_diff > 0
+
+sys.exit(1 if failed else 0)
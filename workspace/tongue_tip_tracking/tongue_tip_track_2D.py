@@ -1,9 +1,8 @@
 import numpy as np 
-from matplotlib import pyplot as plt
 from numba import njit, jit, prange 
-from numba.types import bool_
+from numba.types import bool_, float32, Omitted
 
-@njit("float32[:](int32[:, :])", parallel=True)
+@njit("float32[:](int32[:, :])", cache=True)
 def centroid(a):
     """
     Calculate the centroid of an array of 2D points.
@@ -17,7 +16,7 @@ def centroid(a):
     """
     return np.array([np.mean(a[:, 0]), np.mean(a[:, 1])], dtype=np.float32)
 
-@njit("float32(float32, float32, float32)")
+@njit("float32(float32, float32, float32)", cache=True)
 def clip(a, min_val, max_val):
     """
     Clip a value to a specified range.
@@ -32,7 +31,7 @@ def clip(a, min_val, max_val):
     """
     return np.minimum(np.maximum(a, min_val), max_val)
 
-@njit("bool_[:](bool_[:, :], int32[:, :])", parallel=True)
+@njit("bool_[:](bool_[:, :], int32[:, :])", cache=True)
 def v_is_boundary(img, a):
     """
     For each point in a, check if it is a boundary point in img using 8-connectivity.
@@ -45,15 +44,81 @@ def v_is_boundary(img, a):
     numpy.ndarray: The boolean array of shape (n,) correspondig to a, indicating if the point is a boundary point.
     """
     ans = np.zeros(a.shape[0], dtype=bool_)
-    for i in prange(a.shape[0]):
+    for i in range(a.shape[0]):
         if img[a[i][1]][a[i][0]] == 0:
             continue 
-        for dy in prange(-1, 2):
-            for dx in prange(-1, 2):
+        for dy in range(-1, 2):
+            for dx in range(-1, 2):
                 ans[i] |= (a[i][0]+dx<img.shape[1] and a[i][1]+dy<img.shape[0] and a[i][0]+dx>=0 and a[i][1]+dy>=0 and img[a[i][1] + dy][a[i][0] + dx] == 0)
     return ans
 
-@njit("float32[:](float32[:, :])", parallel=True)
+@njit("bool_[:, :](bool_[:, :])", cache=True)
+def boundary_mask(img):
+    """
+    Compute the boundary of a binary image as img AND NOT erode(img) with a 3x3 element,
+    i.e. the pixels with a background 8-neighbour. Pixels outside the image count as foreground,
+    as in v_is_boundary. The erosion is done as two separable passes.
+
+    Parameters:
+    img (numpy.ndarray): The input binary image.
+
+    Returns:
+    numpy.ndarray: The boolean image of boundary pixels.
+    """
+    h, w = img.shape
+    row_eroded = np.zeros((h, w), dtype=bool_)
+    for y in range(h):
+        for x in range(w):
+            row_eroded[y, x] = img[y, x] and (x == 0 or img[y, x-1]) and (x == w-1 or img[y, x+1])
+    ans = np.zeros((h, w), dtype=bool_)
+    for y in range(h):
+        for x in range(w):
+            ans[y, x] = img[y, x] and not (row_eroded[y, x] and (y == 0 or row_eroded[y-1, x]) and (y == h-1 or row_eroded[y+1, x]))
+    return ans
+
+@njit("bool_[:](bool_[:, :], int32[:, :])", cache=True)
+def v_on_boundary(img, a):
+    """
+    Same result as v_is_boundary, but computes the boundary once with boundary_mask over the
+    bounding box of a and looks each point up in it, instead of testing 8 neighbours per point.
+
+    Parameters:
+    img (numpy.ndarray): The input binary image.
+    a (numpy.ndarray): The input array of 2D points of shape (n, 2).
+
+    Returns:
+    numpy.ndarray: The boolean array of shape (n,) correspondig to a, indicating if the point is a boundary point.
+    """
+    ans = np.zeros(a.shape[0], dtype=bool_)
+    if a.shape[0] == 0:
+        return ans
+    # a one pixel margin keeps the neighbours of every point inside the crop
+    x0 = max(np.min(a[:, 0]) - 1, 0)
+    y0 = max(np.min(a[:, 1]) - 1, 0)
+    x1 = min(np.max(a[:, 0]) + 2, img.shape[1])
+    y1 = min(np.max(a[:, 1]) + 2, img.shape[0])
+    boundary = boundary_mask(img[y0:y1, x0:x1])
+    for i in range(a.shape[0]):
+        ans[i] = boundary[a[i][1] - y0, a[i][0] - x0]
+    return ans
+
+def boundary_masks(masks):
+    """
+    Compute the boundaries of a whole stack of binary images in one vectorized step, as boundary_mask does per image.
+
+    Parameters:
+    masks (numpy.ndarray): The boolean image stack of shape (n, img_height, img_width).
+
+    Returns:
+    numpy.ndarray: The boolean stack of boundary pixels, same shape as masks.
+    """
+    h, w = masks.shape[1:]
+    padded = np.pad(masks, ((0, 0), (1, 1), (1, 1)), constant_values=True)
+    row_eroded = padded[:, :, :-2] & padded[:, :, 1:-1] & padded[:, :, 2:]
+    eroded = row_eroded[:, :-2] & row_eroded[:, 1:-1] & row_eroded[:, 2:]
+    return masks & ~eroded
+
+@njit("float32[:](float32[:, :])", cache=True)
 def v_norm(a):
     """
     Compute magnitude of each 2D vector in a
@@ -65,11 +130,11 @@ def v_norm(a):
     numpy.ndarray: The magnitude of each vector in a as a 1D array of shape (n,).
     """
     ans = np.zeros(a.shape[0], dtype=np.float32)
-    for i in prange(a.shape[0]):
+    for i in range(a.shape[0]):
         ans[i] = np.sqrt(a[i][0]*a[i][0] + a[i][1]*a[i][1])
     return ans
 
-@njit("float32[:](float32[:, :], float32[:])", parallel=True)
+@njit("float32[:](float32[:, :], float32[:])", cache=True)
 def v_angle(a, v2):
     """
     Compute the angle between each 2D vector in a and a fixed vector v2.
@@ -88,44 +153,114 @@ def v_angle(a, v2):
     d = np.dot(np.ascontiguousarray(a), v2)
     if n2 == 0:
         return ans
-    for i in prange(a.shape[0]):
+    for i in range(a.shape[0]):
         if n1[i] == 0:
             ans[i] = 0
             continue
         ans[i] = np.degrees(np.math.acos(clip(d[i] / (n1[i] * n2), np.float32(-1), np.float32(1))))
     return ans
 
-@njit("float32[:](bool_[:, :], float32[:])", parallel=True)
-def find_tongue_tip(img, init_vec):
+@njit("bool_[:](float32[:, :], float32[:], float32)", cache=True)
+def v_within_angle(a, v2, max_deg):
+    """
+    Check for each 2D vector in a if its angle to a fixed vector v2 is below max_deg, same as
+    v_angle(a, v2) < max_deg but without acos. The dot product is compared to cos(max_deg) * |a| * |v2|,
+    both sides squared so that no square roots are needed either.
+
+    Parameters:
+    a (numpy.ndarray): The input array of 2D vectors of shape (n, 2).
+    v2 (numpy.ndarray): The fixed 2D vector of shape (2,).
+    max_deg (np.float32): The angle threshold in degrees.
+
+    Returns:
+    numpy.ndarray: The boolean array of shape (n,) corresponding to a.
+    """
+    # zero vectors have an angle of 0, as in v_angle
+    ans = np.ones(a.shape[0], dtype=bool_)
+    vv = np.float64(v2[0])*v2[0] + np.float64(v2[1])*v2[1]
+    if vv == 0:
+        return ans
+    cos_max = np.cos(np.radians(np.float64(max_deg)))
+    cos_sq = cos_max * cos_max * vv
+    for i in range(a.shape[0]):
+        aa = np.float64(a[i][0])*a[i][0] + np.float64(a[i][1])*a[i][1]
+        if aa == 0:
+            continue
+        d = np.float64(a[i][0])*v2[0] + np.float64(a[i][1])*v2[1]
+        if cos_max >= 0:
+            ans[i] = d > 0 and d*d > cos_sq * aa
+        else:
+            ans[i] = d >= 0 or d*d < cos_sq * aa
+    return ans
+
+@njit("int64(float32[:], float32)", cache=True)
+def int_percentile(a, q):
+    """
+    Compute int(sorted(a)[int(q * len(a))]) for a non-negative array without sorting it.
+    Counts the integer parts of a in a histogram, which takes O(n + max(a)) instead of O(n log n).
+
+    Parameters:
+    a (numpy.ndarray): The input array of non-negative values, e.g. distances bounded by the image diagonal.
+    q (np.float32): The percentile as a fraction in [0, 1].
+
+    Returns:
+    int: The integer part of the percentile.
+    """
+    k = min(int(q * a.shape[0]), a.shape[0] - 1)
+    counts = np.zeros(int(np.max(a)) + 1, dtype=np.int64)
+    for i in range(a.shape[0]):
+        counts[int(a[i])] += 1
+    seen = 0
+    for d in range(counts.shape[0]):
+        seen += counts[d]
+        if seen > k:
+            return d
+    return counts.shape[0] - 1
+
+@njit([
+    float32[:](bool_[:, :], float32[:], float32),
+    float32[:](bool_[:, :], float32[:], Omitted(0.75)),
+], cache=True)
+def find_tongue_tip(img, init_vec, percentile=0.75):
     """
     Find the tongue tip from a binary mask of the tongue.
     
     Parameters:
     img (numpy.ndarray): The input binary image.
+    init_vec (numpy.ndarray): The initial vector in the direction of the tongue.
+    percentile (float): Only pixels farther from the centroid than this percentile distance are candidates.
     
     Returns:
     numpy.ndarray: The tongue tip coordinates as a 1D array of shape (2,).
     """
     mask = np.column_stack(np.where(img == 1)[::-1]).astype(np.int32)
+    if mask.shape[0] == 0:
+        return centroid(mask)
+    # work relative to the first pixel, so that the float rounding does not depend on where img is cropped
+    origin = mask[0].copy()
+    mask -= origin
+    offset = origin.astype(np.float32)
     c1 = centroid(mask)
 
-    dists = v_norm(c1 - mask)
-    dist75 = int(sorted(dists)[int(0.75 * len(dists))])
+    rel = mask - c1
+    dists = v_norm(rel)
+    dist_pct = int_percentile(dists, percentile)
 
     v1 = init_vec 
-    cand1 = mask[np.where(np.logical_and(v_norm(mask - c1) > dist75, v_angle(mask - c1, v1) < 45))]
+    idx1 = np.where(np.logical_and(dists > dist_pct, v_within_angle(rel, v1, np.float32(45))))[0]
+    cand1 = mask[idx1]
 
     if len(cand1) == 0:
-        return c1
+        return c1 + offset
     c2 = centroid(cand1) 
     v2 = c2 - c1
-    cand2 = cand1[np.where(np.logical_and(v_angle(cand1-c1, v2) < 15, v_is_boundary(img, cand1)))]
+    cand2 = cand1[np.where(np.logical_and(v_within_angle(rel[idx1], v2, np.float32(15)), v_on_boundary(img, cand1 + origin)))]
 
     if len(cand2) == 0:
-        return c2
-    return centroid(cand2)
+        return c2 + offset
+    return centroid(cand2) + offset
 
-@njit("float32[:](bool_[:, :], float32[:])", parallel=True)
+@njit("float32[:](bool_[:, :], float32[:])", cache=True)
 def find_tongue_tip_no_dist(img, init_vec):
     """
     Find the tongue tip from a binary mask of the tongue, without using the 75th percentile
@@ -139,20 +274,157 @@ def find_tongue_tip_no_dist(img, init_vec):
     numpy.ndarray: The tongue tip coordinates as a 1D array of shape (2,).
     """
     mask = np.column_stack(np.where(img == 1)[::-1]).astype(np.int32)
+    if mask.shape[0] == 0:
+        return centroid(mask)
+    # work relative to the first pixel, so that the float rounding does not depend on where img is cropped
+    origin = mask[0].copy()
+    mask -= origin
+    offset = origin.astype(np.float32)
     c1 = centroid(mask)
 
+    rel = mask - c1
+
     v1 = init_vec 
-    cand1 = mask[np.where(v_angle(mask - c1, v1) < 45)]
+    idx1 = np.where(v_within_angle(rel, v1, np.float32(45)))[0]
+    cand1 = mask[idx1]
 
     if len(cand1) == 0:
-        return c1
+        return c1 + offset
     c2 = centroid(cand1) 
     v2 = c2 - c1
-    cand2 = cand1[np.where(np.logical_and(v_angle(cand1-c1, v2) < 15, v_is_boundary(img, cand1)))]
+    cand2 = cand1[np.where(np.logical_and(v_within_angle(rel[idx1], v2, np.float32(15)), v_on_boundary(img, cand1 + origin)))]
 
     if len(cand2) == 0:
-        return c2
-    return centroid(cand2)
+        return c2 + offset
+    return centroid(cand2) + offset
+
+@njit("void(bool_[:, :])", cache=True)
+def keep_largest_cc_inplace(img):
+    """
+    Keep the largest 4-connected component in a binary image, in place.
+
+    Parameters:
+    img (numpy.ndarray): The input binary image.
+
+    Returns:
+    None
+    """
+    h, w = img.shape
+    labels = np.zeros((h, w), dtype=np.int32)
+    queue = np.empty(h * w, dtype=np.int32)
+    n_labels, best_label, best_size = 0, 0, 0
+    for y in range(h):
+        for x in range(w):
+            if not img[y, x] or labels[y, x] != 0:
+                continue
+            n_labels += 1
+            labels[y, x] = n_labels
+            queue[0] = y * w + x
+            head, tail = 0, 1
+            while head < tail:
+                py, px = queue[head] // w, queue[head] % w
+                head += 1
+                for dy, dx in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                    ny, nx = py + dy, px + dx
+                    if ny >= 0 and ny < h and nx >= 0 and nx < w and img[ny, nx] and labels[ny, nx] == 0:
+                        labels[ny, nx] = n_labels
+                        queue[tail] = ny * w + nx
+                        tail += 1
+            # ties go to the later component, as with the OpenCV based keep_largest_cc
+            if tail >= best_size:
+                best_size = tail
+                best_label = n_labels
+    for y in range(h):
+        for x in range(w):
+            img[y, x] = labels[y, x] == best_label and best_label != 0
+
+@njit("float32[:, :](int64[:], int16[:], int16[:], float32[:], boolean, int64, float32, int64, int64)", parallel=True, nogil=True, cache=True)
+def track_ragged(offsets, heights, widths, init_vec, use_dist, min_pixels, percentile, img_height, img_width):
+    """
+    Run the whole mask cleanup and tip tracking pipeline on a ragged batch of masks, in parallel over masks.
+    The pixels of mask i are heights[offsets[i]:offsets[i+1]], widths[offsets[i]:offsets[i+1]].
+    Each mask is cropped like tongue_mask_processing._plot_roi, and the tip is shifted back to image coordinates.
+
+    Parameters:
+    offsets (numpy.ndarray): The offset of each mask into heights and widths, shape (n+1,).
+    heights (numpy.ndarray): The flat row coordinates of all masks.
+    widths (numpy.ndarray): The flat column coordinates of all masks.
+    init_vec (numpy.ndarray): The initial vector in the direction of the tongue.
+    use_dist (bool): Use find_tongue_tip if True, otherwise find_tongue_tip_no_dist.
+    min_pixels (int): Masks with this many pixels or fewer are skipped.
+    percentile (float): The distance percentile passed to find_tongue_tip.
+    img_height (int): The height of the image, the margin is clipped to it.
+    img_width (int): The width of the image, the margin is clipped to it.
+
+    Returns:
+    numpy.ndarray: The tongue tip coordinates of shape (n, 2), NaN for skipped masks.
+    """
+    n = offsets.shape[0] - 1
+    tips = np.full((n, 2), np.nan, dtype=np.float32)
+    for i in prange(n):
+        if offsets[i + 1] - offsets[i] <= min_pixels:
+            continue
+        lo, hi = offsets[i], offsets[i + 1]
+        top = max(np.int64(np.min(heights[lo:hi])) - 1, 0)
+        left = max(np.int64(np.min(widths[lo:hi])) - 1, 0)
+        bottom = min(np.int64(np.max(heights[lo:hi])) + 2, img_height)
+        right = min(np.int64(np.max(widths[lo:hi])) + 2, img_width)
+        img = np.zeros((bottom - top, right - left), dtype=bool_)
+        for j in range(lo, hi):
+            img[heights[j] - top, widths[j] - left] = True
+        keep_largest_cc_inplace(img)
+        if use_dist:
+            tip = find_tongue_tip(img, init_vec, percentile)
+        else:
+            tip = find_tongue_tip_no_dist(img, init_vec)
+        tips[i, 0] = tip[0] + left
+        tips[i, 1] = tip[1] + top
+    return tips
+
+def track_archive(archive, init_vec, mode="dist", min_pixels=15, percentile=0.75, img_height=256, img_width=256, chunk=65536, start=0, stop=None):
+    """
+    Track the tongue tip over a whole session: pixel count filter, largest connected component
+    and tip search, run in one parallel loop over frames.
+
+    Parameters:
+    archive (TongueArchive or MaskStack): The masks to track, read in chunks from a TongueArchive.
+    init_vec (numpy.ndarray): The initial vector in the direction of the tongue.
+    mode (str): "dist" for find_tongue_tip or "no_dist" for find_tongue_tip_no_dist.
+    min_pixels (int): Masks with this many pixels or fewer are skipped.
+    percentile (float): The distance percentile used in "dist" mode.
+    img_height (int): The height of the image.
+    img_width (int): The width of the image.
+    chunk (int): The number of frames read from a TongueArchive at a time.
+    start (int): The first archive index to track, for a TongueArchive.
+    stop (int): One past the last archive index to track, defaults to the end.
+
+    Returns:
+    numpy.ndarray: The tongue tip coordinates of shape (n, 2) aligned with archive.frames[start:stop],
+    NaN for skipped frames.
+
+    Raises:
+    ValueError: If mode is unknown or a mask does not fit the img_height x img_width image.
+    """
+    if mode not in ("dist", "no_dist"):
+        raise ValueError(f"Unknown mode {mode!r}, expected 'dist' or 'no_dist'")
+    init_vec = np.asarray(init_vec, dtype=np.float32)
+
+    if hasattr(archive, "read_stack"):
+        n = len(archive.frames) if stop is None else stop
+        stacks = (archive.read_stack(lo, min(lo + chunk, n), img_height, img_width) for lo in range(start, n, chunk))
+    else:
+        stacks = [archive]
+
+    tips = []
+    for s in stacks:
+        # track_ragged writes the pixels without bounds checks
+        if len(s.heights) > 0 and (s.heights.max() >= s.img_height or s.widths.max() >= s.img_width
+                                   or s.heights.min() < 0 or s.widths.min() < 0):
+            raise ValueError(f"Mask pixels do not fit a {s.img_height}x{s.img_width} image, check img_height and img_width")
+        tips.append(track_ragged(s.offsets, s.heights, s.widths, init_vec, mode == "dist", min_pixels, percentile, s.img_height, s.img_width))
+    if len(tips) == 0:
+        return np.zeros((0, 2), dtype=np.float32)
+    return np.concatenate(tips)
 
 def load_bool_img(path):
     """
@@ -164,6 +436,7 @@ def load_bool_img(path):
     Returns:
     numpy.ndarray: The binary image as a 2D numpy array.
     """
+    from matplotlib import pyplot as plt
     img = plt.imread(path)
     grayscale_img = np.dot(img[...,:3], [0.2989, 0.5870, 0.1140])
     threshold = 0.5
@@ -181,6 +454,7 @@ def plot_tip(img, tip):
     Returns:
     None
     """
+    from matplotlib import pyplot as plt
     plt.imshow(img, cmap="gray")
     plt.scatter(x = tip[0], y = tip[1], c = "r", s = 10);
     plt.show()